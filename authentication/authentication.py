@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+from authentication import token_cache
+from jwt_utils.codec import is_signed_jwt
+from jwt_utils.digest import token_digest
 from jwt_utils.jwt_validator import jwt_validator
 from rest_framework import authentication
 from rest_framework import exceptions
@@ -8,11 +11,41 @@ from users.models import Token
 class JwtTokensAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
         token_id = request.headers.get("Authorization", "")
+        if is_signed_jwt(token_id):
+            return self.authenticate_locally(token_id)
+        payload = token_cache.lookup(token_id)
+        if payload is not None:
+            return payload, None
         try:
             payload = jwt_validator(token_id)
-            Token.objects.get(access_token=token_id, is_expired=0)
+            if not is_access(payload):
+                raise self.failed()
+            Token.objects.get(
+                access_token_digest=token_digest(token_id),
+                is_expired=0,
+                user_id__is_active=True,
+            )
+            token_cache.remember(token_id, payload)
             return payload, None
         except Exception:
-            raise exceptions.AuthenticationFailed(
-                detail={"code": 401, "message": "Expired or Invalid Token"}
-            )
+            raise self.failed()
+
+    def authenticate_locally(self, token_id):
+        """Verify a plain signed jwt by signature, exp and revocation list."""
+        try:
+            payload = jwt_validator(token_id)
+        except Exception:
+            raise self.failed()
+        if not is_access(payload) or token_cache.is_revoked(payload):
+            raise self.failed()
+        return payload, None
+
+    def failed(self):
+        return exceptions.AuthenticationFailed(
+            detail={"code": 401, "message": "Expired or Invalid Token"}
+        )
+
+
+def is_access(payload):
+    """Refresh tokens are signed the same way but never authenticate."""
+    return payload.get("type") == "access"
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+removal of expired Token rows, in bounded batches, and of expired revocations
+"""
+import threading
+import time
+
+from django.db import close_old_connections
+
+from authentication.token_cache import prune_revoked
+from invoice_gen import settings
+from invoice_gen.settings import logger
+from users.models import Token
+
+_sweeper = None
+
+
+def prune_tokens(batch_size=None, max_batches=None):
+    """Delete stale tokens batch by batch and return how many were removed."""
+    batch_size = batch_size or settings.TOKEN_SWEEP_BATCH_SIZE
+    removed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        pks = list(
+            Token.objects.stale()
+            .order_by("pk")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not pks:
+            break
+        deleted, _ = Token.objects.filter(pk__in=pks).delete()
+        removed += deleted
+        batches += 1
+    return removed
+
+
+def _sweep_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            started = time.time()
+            removed = prune_tokens()
+            revoked = prune_revoked()
+            logger.info(
+                "token sweeper removed %s tokens and %s revocations in %.2fs"
+                % (removed, revoked, time.time() - started)
+            )
+        except Exception as ex:
+            logger.error(ex)
+        finally:
+            close_old_connections()
+
+
+def start_sweeper(interval=None):
+    """Start the periodic token sweeper thread of this process once."""
+    global _sweeper
+    interval = settings.TOKEN_SWEEP_INTERVAL if interval is None else interval
+    if _sweeper is not None or not interval:
+        return _sweeper
+    _sweeper = threading.Thread(
+        target=_sweep_forever, args=(interval,), name="token-sweeper", daemon=True
+    )
+    _sweeper.start()
+    return _sweeper
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+cache of validated access tokens, so authentication skips the database, and
+the revocation list of signed jwt ids: kept in the RevokedToken table, read
+from a copy in each process that is reloaded when its version in the token
+cache changes
+"""
+import datetime
+import threading
+import time
+import uuid
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from invoice_gen import settings
+from jwt_utils.codec import default_codec
+from jwt_utils.digest import token_digest
+from users.models import APIUser
+from users.models import RevokedToken
+
+KEY_PREFIX = "token:"
+REVOKED_VERSION_KEY = "revoked:version"
+
+_lock = threading.Lock()
+# (version, revoked jtis, inactive user ids)
+_revoked = None
+
+
+def _cache():
+    return caches[settings.TOKEN_CACHE_ALIAS]
+
+
+def _key(token):
+    return KEY_PREFIX + token_digest(token)
+
+
+def lookup(token):
+    """Return the cached payload of a validated token, or None."""
+    if not token:
+        return None
+    payload = _cache().get(_key(token))
+    if payload is None or payload.get("exp", 0) <= time.time():
+        return None
+    return payload
+
+
+def remember(token, payload):
+    """Cache a validated token until its exp."""
+    timeout = payload.get("exp", 0) - time.time()
+    if settings.TOKEN_CACHE_MAX_AGE is not None:
+        timeout = min(timeout, settings.TOKEN_CACHE_MAX_AGE)
+    if timeout > 0:
+        _cache().set(_key(token), payload, timeout)
+
+
+def forget(*tokens):
+    """Drop tokens from the cache, e.g. on logout."""
+    keys = [_key(token) for token in tokens if token]
+    if keys:
+        _cache().delete_many(keys)
+
+
+def revoke(*payloads):
+    """Add token ids to the revocation list until their exp."""
+    now = time.time()
+    entries = {}
+    for payload in payloads:
+        if not payload or not payload.get("jti"):
+            continue
+        if payload.get("exp", 0) > now:
+            expires_at = datetime.datetime.fromtimestamp(payload["exp"], timezone.utc)
+            entries[payload["jti"]] = RevokedToken(
+                jti=payload["jti"], expires_at=expires_at
+            )
+    if entries:
+        RevokedToken.objects.bulk_create(entries.values(), ignore_conflicts=True)
+        revocations_changed()
+
+
+def revocations_changed():
+    """Make every process reload the revocation list, now and once committed."""
+
+    def bump():
+        _cache().set(REVOKED_VERSION_KEY, uuid.uuid4().hex, None)
+
+    bump()
+    # a reload before the commit doesn't see the change, reload again after it
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(bump)
+
+
+def _revocations():
+    global _revoked
+    version = _cache().get(REVOKED_VERSION_KEY)
+    with _lock:
+        if _revoked is not None and version is not None and _revoked[0] == version:
+            return _revoked
+        if version is None:
+            # cold or evicted: start a new version, or take a concurrent one
+            version = uuid.uuid4().hex
+            if not _cache().add(REVOKED_VERSION_KEY, version, None):
+                version = _cache().get(REVOKED_VERSION_KEY) or version
+        jtis = RevokedToken.objects.filter(expires_at__gte=timezone.now())
+        inactive = APIUser.objects.filter(is_active=False)
+        _revoked = (
+            version,
+            frozenset(jtis.values_list("jti", flat=True)),
+            frozenset(inactive.values_list("pk", flat=True)),
+        )
+        return _revoked
+
+
+def expire(*tokens):
+    """Forget and revoke access and refresh tokens, e.g. on logout."""
+    tokens = [token for token in tokens if token]
+    forget(*tokens)
+    revoke(*default_codec.decode_many(tokens))
+
+
+def expire_pairs(pairs):
+    """expire() the tokens of (access_token, refresh_token) pairs."""
+    expire(*(token for pair in pairs for token in pair))
+
+
+def is_revoked(payload):
+    """
+    True when the token id was revoked or its user is inactive. Costs one
+    token cache read; the database is only read after a change.
+    """
+    jti = payload.get("jti")
+    if not jti:
+        return True
+    _, jtis, inactive = _revocations()
+    return jti in jtis or payload.get("user_id") in inactive
+
+
+def prune_revoked(now=None):
+    """Delete revocations past their token's exp, return how many."""
+    deleted, _ = RevokedToken.objects.filter(
+        expires_at__lt=now or timezone.now()
+    ).delete()
+    return deleted
@@ -111,6 +111,19 @@ WSGI_APPLICATION = "invoice_gen.wsgi.application"
 DATABASES = config.DATABASES
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# the local-memory default is per process, configure a shared backend
+# (memcached, redis) when several workers serve requests so logout
+# invalidates validated tokens everywhere.
+
+CACHES = getattr(
+    config,
+    "CACHES",
+    {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -151,6 +164,45 @@ STATIC_URL = "/static/"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 BASIC_PDF_URL = "http://127.0.0.1:8000/media/"
+# invoice lines validated and inserted per bulk_create
+INVOICE_INGEST_CHUNK_SIZE = getattr(config, "INVOICE_INGEST_CHUNK_SIZE", 1000)
+# rejected lines echoed back by the csv/ndjson upload endpoint
+INVOICE_UPLOAD_MAX_ERRORS = getattr(config, "INVOICE_UPLOAD_MAX_ERRORS", 100)
+# invoice lines per page of the listing api, and the most a client may ask for
+INVOICE_PAGE_SIZE = getattr(config, "INVOICE_PAGE_SIZE", 50)
+INVOICE_MAX_PAGE_SIZE = getattr(config, "INVOICE_MAX_PAGE_SIZE", 500)
+# number of worker processes rendering queued invoice reports
+REPORT_WORKERS = getattr(config, "REPORT_WORKERS", 2)
+# invoice lines fetched per query by batch report generation
+REPORT_BATCH_CHUNK_SIZE = getattr(config, "REPORT_BATCH_CHUNK_SIZE", 2000)
+# load weasyprint, the report stylesheet and fonts when the app starts
+REPORT_WARM_RENDERER = getattr(config, "REPORT_WARM_RENDERER", False)
+# rendered reports are cached in MEDIA_ROOT/REPORT_CACHE_DIR
+REPORT_CACHE_DIR = "reports"
+REPORT_CACHE_MAX_BYTES = getattr(config, "REPORT_CACHE_MAX_BYTES", 500 * 1024 * 1024)
+REPORT_CACHE_MAX_AGE = getattr(config, "REPORT_CACHE_MAX_AGE", 7 * 24 * 3600)
+# objects serialized per query by the admin fixture export
+FIXTURE_CHUNK_SIZE = getattr(config, "FIXTURE_CHUNK_SIZE", 2000)
+# threads running admin dumpdata/loaddata jobs; outside prod the dumps are
+# written to ADMIN_EXPORT_ROOT, outside MEDIA_ROOT, and downloaded through a
+# login protected view
+ADMIN_JOB_WORKERS = getattr(config, "ADMIN_JOB_WORKERS", 1)
+# running jobs write their row count every ADMIN_JOB_PROGRESS_INTERVAL
+# seconds, and are failed once they have not done so for ADMIN_JOB_STALE_AFTER
+ADMIN_JOB_PROGRESS_INTERVAL = getattr(config, "ADMIN_JOB_PROGRESS_INTERVAL", 5)
+ADMIN_JOB_STALE_AFTER = getattr(config, "ADMIN_JOB_STALE_AFTER", 600)
+ADMIN_EXPORT_ROOT = os.path.join(BASE_DIR, "exports")
+# admin change lists of unfiltered tables with at least this many rows show
+# the planner's estimate instead of counting them
+ADMIN_ESTIMATED_COUNT_THRESHOLD = getattr(
+    config, "ADMIN_ESTIMATED_COUNT_THRESHOLD", 100000
+)
+# rows updated or deleted per statement by the set-based admin actions
+ADMIN_ACTION_CHUNK_SIZE = getattr(config, "ADMIN_ACTION_CHUNK_SIZE", 5000)
+# reports are totalled in BASE_CURRENCY, lines in other currencies are
+# converted with the CurrencyRate table, reloaded every CURRENCY_RATE_TTL seconds
+BASE_CURRENCY = getattr(config, "BASE_CURRENCY", "USD")
+CURRENCY_RATE_TTL = getattr(config, "CURRENCY_RATE_TTL", 300)
 
 # Jwt configurations
 JWT_SECRET = config.JWT_SECRET
@@ -159,3 +211,16 @@ AES_IV = config.AES_IV
 JWT_ALGORITHM = config.JWT_ALGORITHM
 TOKEN_EXPIRY = config.TOKEN_EXPIRY
 REFRESH_TOKEN_EXPIRY = config.REFRESH_TOKEN_EXPIRY
+# "aes" issues AES wrapped tokens checked against the Token table, "jwt"
+# issues plain signed jwts verified by signature and a per process copy of the
+# RevokedToken table, reloaded when a version in TOKEN_CACHE_ALIAS changes;
+# several processes need a shared cache to see each other's revocations.
+# Both formats are accepted whatever the setting.
+TOKEN_FORMAT = getattr(config, "TOKEN_FORMAT", "aes")
+# cache holding validated access tokens until their exp
+TOKEN_CACHE_ALIAS = getattr(config, "TOKEN_CACHE_ALIAS", "default")
+# optional upper bound in seconds on how long a validated token is cached
+TOKEN_CACHE_MAX_AGE = getattr(config, "TOKEN_CACHE_MAX_AGE", None)
+# seconds between stale token sweeps in each web process, 0 disables it
+TOKEN_SWEEP_INTERVAL = getattr(config, "TOKEN_SWEEP_INTERVAL", 3600)
+TOKEN_SWEEP_BATCH_SIZE = getattr(config, "TOKEN_SWEEP_BATCH_SIZE", 1000)
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "invoice_gen.settings")
 
 application = get_wsgi_application()
+
+from authentication.sweeper import start_sweeper  # noqa: E402
+
+start_sweeper()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+token codec: signs the jwt payload and, in the "aes" format, wraps it in AES-CFB
+"""
+import base64
+import time
+import uuid
+
+import jwt
+from Crypto.Cipher import AES
+
+from invoice_gen import settings
+
+
+class TokenCodec(object):
+    """Encodes and decodes api tokens with keys prepared once."""
+
+    def __init__(self, jwt_secret, algorithm, aes_secret, aes_iv, token_format="aes"):
+        self.token_format = token_format
+        self.jwt_secret = jwt_secret
+        self.algorithm = algorithm
+        self.algorithms = [algorithm]
+        self.key = aes_secret.encode("utf8")
+        self.iv = aes_iv.encode("utf8")
+        self.options = {"verify_exp": True}
+
+    @classmethod
+    def from_settings(cls, jwt_secret=None):
+        return cls(
+            jwt_secret or settings.JWT_SECRET,
+            settings.JWT_ALGORITHM,
+            settings.AES_SECRET,
+            settings.AES_IV,
+            settings.TOKEN_FORMAT,
+        )
+
+    def _cipher(self):
+        # CFB keeps state between calls, every token needs a fresh cipher
+        return AES.new(self.key, AES.MODE_CFB, self.iv)
+
+    def encrypt(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf8")
+        return base64.b64encode(self._cipher().encrypt(data)).decode()
+
+    def decrypt(self, encoded):
+        return self._cipher().decrypt(base64.b64decode(encoded)).decode()
+
+    def payload(self, user_id, ttl, token_type, is_admin, now):
+        issued_at = int(now)
+        exp = int(now + ttl / 1000.0) if ttl >= 0 else issued_at
+        return {
+            "user_id": user_id,
+            "is_admin": is_admin,
+            "type": token_type,
+            "issued_at": issued_at,
+            "exp": exp,
+            "jti": uuid.uuid4().hex,
+        }
+
+    def sign(self, payload):
+        token = jwt.encode(payload, self.jwt_secret, self.algorithm)
+        return token.decode() if isinstance(token, bytes) else token
+
+    def wrap(self, payload):
+        if self.token_format == "jwt":
+            return self.sign(payload)
+        return self.encrypt(self.sign(payload))
+
+    def encode(self, user_id, ttl, token_type, is_admin):
+        """Return a token in the configured format; ttl is in milliseconds."""
+        return self.wrap(self.payload(user_id, ttl, token_type, is_admin, time.time()))
+
+    def encode_many(self, claims):
+        """Encode (user_id, ttl, token_type, is_admin) tuples at one timestamp."""
+        now = time.time()
+        return [self.wrap(self.payload(*claim, now=now)) for claim in claims]
+
+    def decode(self, token):
+        """
+        Return the payload of a token in either format, raising on a bad or
+        expired one.
+        """
+        if not is_signed_jwt(token):
+            token = self.decrypt(token)
+        return jwt.decode(
+            token, self.jwt_secret, algorithms=self.algorithms, options=self.options
+        )
+
+    def decode_many(self, tokens):
+        """Decode tokens, returning None in place of invalid ones."""
+        payloads = []
+        for token in tokens:
+            try:
+                payloads.append(self.decode(token))
+            except Exception:
+                payloads.append(None)
+        return payloads
+
+
+def is_signed_jwt(token):
+    """True for a plain signed jwt, False for an AES wrapped one."""
+    return token.startswith("eyJ") and token.count(".") == 2
+
+
+default_codec = TokenCodec.from_settings()
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+
+def token_digest(token):
+    """Fixed-length sha256 hex digest of a token, used for indexed lookups."""
+    if token is None:
+        return None
+    return hashlib.sha256(token.encode("utf8")).hexdigest()
@@ -1,34 +1,10 @@
 # -*- coding: utf-8 -*-
-from datetime import datetime
-from datetime import timedelta
-
-import jwt
-
-from jwt_utils.encryption import AESCipher
-from invoice_gen.settings import JWT_ALGORITHM
-
-FORMAT = "%Y-%m-%d %H:%M:%S"
+from jwt_utils.codec import TokenCodec
+from jwt_utils.codec import default_codec
 
 
 def jwt_generator(user_id, jwt_secret, jwt_ttl, token_type, is_admin):
-    current_time = datetime.now()
-    time = current_time.strftime(FORMAT)
-    actual_exp = datetime.strptime(time, FORMAT)
-
-    if jwt_ttl >= 0:
-        exp_time = current_time + timedelta(milliseconds=jwt_ttl)
-        exp_at = exp_time.strftime(FORMAT)
-        actual_exp = datetime.strptime(exp_at, FORMAT)
-    payload = {
-        "user_id": user_id,
-        "is_admin": is_admin,
-        "type": token_type,
-        "issued_at": time,
-        "exp": actual_exp.timestamp(),
-    }
-    jwt_token = jwt.encode(payload, jwt_secret, JWT_ALGORITHM)
-    # return jwt_token.decode()
-
-    obj = AESCipher()
-    encoded_token = obj.encrypt_token(jwt_token)
-    return encoded_token
+    codec = default_codec
+    if jwt_secret != codec.jwt_secret:
+        codec = TokenCodec.from_settings(jwt_secret)
+    return codec.encode(user_id, jwt_ttl, token_type, is_admin)
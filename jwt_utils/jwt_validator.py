@@ -2,24 +2,13 @@
 """
 class used for jwt validator
 """
-import jwt
 from rest_framework import exceptions
 
-from jwt_utils.encryption import AESCipher
-from invoice_gen import settings
-from invoice_gen.settings import JWT_ALGORITHM
-
-jwt_secret = settings.JWT_SECRET
-options = {"verify_exp": True}
+from jwt_utils.codec import default_codec
 
 
 def jwt_validator(token):
     try:
-        obj = AESCipher()
-        decoded = obj.decrypt_token(token)
-        payload = jwt.decode(
-            decoded, jwt_secret, algorithm=JWT_ALGORITHM, options=options
-        )
-        return payload
+        return default_codec.decode(token)
     except Exception:
         raise exceptions.AuthenticationFailed
@@ -6,7 +6,16 @@ from django.contrib.auth.forms import UserChangeForm
 from django.contrib.auth.forms import UserCreationForm
 from django.urls import reverse
 
-from users.models import APIUser, Invoice
+from users.admin_jobs import is_prod
+from users.admin_jobs import recent_jobs
+from users.batch import generate_reports
+from users.bulk_actions import deactivate_users
+from users.bulk_actions import delete_invoice_lines
+from users.bulk_actions import retax_invoice_lines
+from users.models import AdminJob, APIUser, CurrencyRate, Invoice, ReportJob
+from users.pagination import EstimatedCountPaginator
+from users.pricing import from_fixed
+from users.pricing import from_minor
 
 
 class APIUserCreationForm(UserCreationForm):
@@ -57,18 +66,117 @@ class APIUserAdmin(UserAdmin):
     )
     search_fields = ("email",)
     ordering = ("email",)
+    actions = ["deactivate_users"]
+
+    def deactivate_users(self, request, queryset):
+        # keep the acting admin able to log in
+        stats = deactivate_users(queryset.exclude(pk=request.user.pk))
+        self.message_user(
+            request,
+            "%(rows)s users deactivated and their tokens revoked in %(elapsed).2fs"
+            % stats,
+        )
+
+    deactivate_users.short_description = "Deactivate selected users and revoke tokens"
+    deactivate_users.allowed_permissions = ("change",)
 
 
 admin.site.register(APIUser, APIUserAdmin)
 
 
+def retax_action(tax):
+    """Build the admin action moving the selected lines to the tax bracket."""
+
+    def action(modeladmin, request, queryset):
+        stats = retax_invoice_lines(queryset, tax)
+        stats["tax"] = tax
+        modeladmin.message_user(
+            request,
+            "%(rows)s invoice lines moved to tax %(tax)s%% in %(elapsed).2fs" % stats,
+        )
+
+    action.__name__ = "retax_%s" % tax
+    action.short_description = "Set tax of selected lines to %s%%%%" % tax
+    return action
+
+
 class InvoiceAdmin(admin.ModelAdmin):
     list_display = (
         "__str__",
+        "currency",
         "total_price",
         "tax_amount",
         "discount_amount",
+        "created_at",
     )
+    list_filter = ("tax", "currency")
+    date_hierarchy = "created_at"
+    ordering = ("-created_at", "-id")
+    paginator = EstimatedCountPaginator
+    # the filtered count is enough, don't count the whole table on every page
+    show_full_result_count = False
+    actions = ["generate_reports", "delete_lines"]
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # saves the per object deletes and their summary updates
+        actions.pop("delete_selected", None)
+        if self.has_change_permission(request):
+            for tax, _ in Invoice.TAX:
+                action = retax_action(tax)
+                actions[action.__name__] = (
+                    action,
+                    action.__name__,
+                    action.short_description,
+                )
+        return actions
+
+    def get_queryset(self, request):
+        # the price columns are the integer amounts the reports sum, computed
+        # by the database so they can be sorted
+        return super().get_queryset(request).with_minor_totals()
+
+    def total_price(self, obj):
+        return None if obj.line_minor is None else from_minor(obj.line_minor)
+
+    total_price.short_description = "total price"
+    total_price.admin_order_field = "line_minor"
+
+    def tax_amount(self, obj):
+        return None if obj.line_tax_fixed is None else from_fixed(obj.line_tax_fixed)
+
+    tax_amount.short_description = "tax amount"
+    tax_amount.admin_order_field = "line_tax_fixed"
+
+    def discount_amount(self, obj):
+        if obj.line_discount_fixed is None:
+            return None
+        return from_fixed(obj.line_discount_fixed)
+
+    discount_amount.short_description = "discount amount"
+    discount_amount.admin_order_field = "line_discount_fixed"
+
+    def generate_reports(self, request, queryset):
+        user_ids = set(
+            queryset.filter(user_id__isnull=False).values_list("user_id", flat=True)
+        )
+        stats = generate_reports(user_ids=user_ids)
+        self.message_user(
+            request,
+            "%(users)s users: %(rendered)s rendered, %(cached)s cached, "
+            "%(failed)s failed in %(elapsed).1fs (%(rate).1f pdf/s)" % stats,
+        )
+
+    generate_reports.short_description = "Generate reports for the selected users"
+
+    def delete_lines(self, request, queryset):
+        stats = delete_invoice_lines(queryset)
+        self.message_user(
+            request, "%(rows)s invoice lines deleted in %(elapsed).2fs" % stats
+        )
+
+    delete_lines.short_description = "Delete selected invoice lines"
+    delete_lines.allowed_permissions = ("delete",)
 
     def changelist_view(self, request, extra_context=None):
         extra = {}
@@ -78,7 +186,45 @@ class InvoiceAdmin(admin.ModelAdmin):
         extra["url_dumpdata_general"] = reverse(
             "dumpdata_general", args=[self.model.__name__]
         )
+        jobs = recent_jobs(self.model._meta.app_label, self.model.__name__)
+        extra["admin_jobs"] = jobs
+        extra["admin_jobs_running"] = any(
+            job.status in (ReportJob.PENDING, ReportJob.RUNNING) for job in jobs
+        )
+        # prod dumps are committed to the repository, not downloaded
+        extra["exports_downloadable"] = not is_prod()
         return super().changelist_view(request, extra_context=extra)
 
 
 admin.site.register(Invoice, InvoiceAdmin)
+
+
+class CurrencyRateAdmin(admin.ModelAdmin):
+    list_display = ("currency", "rate", "updated_at")
+    ordering = ("currency",)
+
+    def has_delete_permission(self, request, obj=None):
+        # lines in a currency can't be totalled without its rate
+        if obj is not None and obj.in_use():
+            return False
+        return super().has_delete_permission(request, obj)
+
+
+admin.site.register(CurrencyRate, CurrencyRateAdmin)
+
+
+class AdminJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "pk",
+        "kind",
+        "application",
+        "model",
+        "status",
+        "rows",
+        "started_at",
+        "finished_at",
+    )
+    list_filter = ("kind", "status")
+
+
+admin.site.register(AdminJob, AdminJobAdmin)
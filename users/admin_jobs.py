@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+thread pool running the admin dumpdata and loaddata operations outside the
+request thread
+"""
+import datetime
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.core import management
+from django.db import close_old_connections
+from django.db import connection
+from django.utils import timezone
+
+from invoice_gen import settings
+from invoice_gen.settings import logger
+from users.fixture_io import dump_fixture
+from users.fixture_io import find_fixture
+from users.fixture_io import link_backup
+from users.fixture_io import load_invoice_fixture
+from users.models import AdminJob
+from users.models import Invoice
+from users.models import ReportJob
+
+_pool = None
+
+
+def get_pool():
+    """Return the admin job pool, starting it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(
+            max_workers=settings.ADMIN_JOB_WORKERS, thread_name_prefix="admin-job"
+        )
+    return _pool
+
+
+def is_prod():
+    return os.environ.get("app") == "prod"
+
+
+def _update_job(job_id, **fields):
+    AdminJob.objects.filter(pk=job_id).update(updated_at=timezone.now(), **fields)
+
+
+def _finish_job(job_id, **fields):
+    """
+    Record the outcome of a job still running. A job already failed by
+    expire_stale_jobs keeps its status and is only logged.
+    """
+    finished = AdminJob.objects.filter(pk=job_id, status=ReportJob.RUNNING).update(
+        updated_at=timezone.now(), finished_at=timezone.now(), **fields
+    )
+    if not finished:
+        logger.error("admin job %s finished after being expired" % job_id)
+
+
+@contextmanager
+def _heartbeat(job_id):
+    """
+    Touch the job every ADMIN_JOB_PROGRESS_INTERVAL seconds from a side
+    thread, for work which reports no progress of its own.
+    """
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(settings.ADMIN_JOB_PROGRESS_INTERVAL):
+                _update_job(job_id)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name="admin-job-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def _progress(job_id):
+    """
+    Return a progress callback writing the row count to the job at most every
+    ADMIN_JOB_PROGRESS_INTERVAL seconds, which also marks it alive.
+    """
+    last = [time.time()]
+
+    def report(stats):
+        now = time.time()
+        if now - last[0] >= settings.ADMIN_JOB_PROGRESS_INTERVAL:
+            last[0] = now
+            _update_job(job_id, rows=stats["rows"])
+
+    return report
+
+
+def submit(kind, application, model, user=None, compression=None):
+    """Queue an admin dumpdata or loaddata of application.model."""
+    job = AdminJob.objects.create(
+        kind=kind,
+        application=application,
+        model=model,
+        compression=compression,
+        created_by=user,
+    )
+    try:
+        get_pool().submit(run_job, job.pk)
+    except Exception as ex:
+        logger.error(ex)
+        _update_job(job.pk, status=ReportJob.FAILED, error=str(ex))
+        job.refresh_from_db()
+    return job
+
+
+def run_job(job_id):
+    """Run a queued job, inside a pool thread with its own connection."""
+    try:
+        job = AdminJob.objects.get(pk=job_id)
+        stats = {"rows": 0}
+        progress = _progress(job_id)
+        _update_job(job_id, status=ReportJob.RUNNING, started_at=timezone.now())
+        try:
+            if job.kind == AdminJob.DUMPDATA:
+                file_name = dumpdata(job, stats, progress)
+            else:
+                file_name = loaddata(job, stats, progress)
+        except Exception as ex:
+            logger.error(ex)
+            _finish_job(
+                job_id, status=ReportJob.FAILED, error=str(ex), rows=stats["rows"]
+            )
+        else:
+            _finish_job(
+                job_id, status=ReportJob.DONE, file_name=file_name, rows=stats["rows"]
+            )
+    finally:
+        close_old_connections()
+
+
+def dumpdata(job, stats, progress=None):
+    """Write the fixture of the job's model and return its file name."""
+    queryset = apps.get_model(job.application, job.model)._default_manager.all()
+    name = job.model.lower()
+    if not is_prod():
+        # kept out of the source tree and of MEDIA_ROOT, the admin downloads
+        # it through the download_export view
+        file_name = "%s_%s.json" % (name, datetime.date.today())
+        if job.compression:
+            file_name += "." + job.compression
+        path = export_path(file_name)
+        os.makedirs(settings.ADMIN_EXPORT_ROOT, exist_ok=True)
+        dump_fixture(queryset, path, stats=stats, progress=progress)
+        return file_name
+
+    # Dumps data from installed models to main fixtures folder
+    path = "%s/fixtures/%s.json" % (job.application, name)
+    dump_fixture(queryset, path, stats=stats, progress=progress)
+    commit_fixture(path)
+    # A backup of the same dump (with date in file name)
+    link_backup(
+        path, "%s/fixtures/%s_%s.json" % (job.application, name, datetime.date.today())
+    )
+    return path
+
+
+def export_path(file_name):
+    """Path of an export in ADMIN_EXPORT_ROOT, None for any other name."""
+    if not file_name or os.path.basename(file_name) != file_name:
+        return None
+    if file_name.startswith("."):
+        return None
+    return os.path.join(settings.ADMIN_EXPORT_ROOT, file_name)
+
+
+def commit_fixture(path):
+    """Commit and push a fixture written on the server."""
+    message = "fixtures from server " + str(datetime.datetime.now())
+    for command in (
+        ["git", "add", path],
+        ["git", "commit", "-m", message],
+        ["git", "push"],
+    ):
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode:
+            logger.error("%s: %s" % (" ".join(command), result.stderr.strip()))
+
+
+def loaddata(job, stats, progress=None):
+    """Load the fixture of the job's model and return its path."""
+    directory = "%s/fixtures" % job.application
+    path = find_fixture(directory, job.model.lower())
+    if path is None:
+        raise ValueError("no %s fixture in %s" % (job.model.lower(), directory))
+    if apps.get_model(job.application, job.model) is Invoice:
+        load_invoice_fixture(path, stats=stats, progress=progress)
+    else:
+        # loaddata reports nothing until it is done
+        with _heartbeat(job.pk):
+            management.call_command("loaddata", path)
+    return path
+
+
+def expire_stale_jobs():
+    """
+    Fail the jobs left behind by a restarted or killed worker: running jobs
+    whose progress stopped for ADMIN_JOB_STALE_AFTER seconds, and pending
+    ones that old while no job is running to hold them in the queue.
+    """
+    now = timezone.now()
+    cutoff = now - datetime.timedelta(seconds=settings.ADMIN_JOB_STALE_AFTER)
+    stale = AdminJob.objects.filter(status=ReportJob.RUNNING, updated_at__lt=cutoff)
+    expired = stale.update(
+        status=ReportJob.FAILED, error="no progress, worker lost", finished_at=now
+    )
+    running = AdminJob.objects.filter(status=ReportJob.RUNNING)
+    if not running.exists():
+        expired += AdminJob.objects.filter(
+            status=ReportJob.PENDING, updated_at__lt=cutoff
+        ).update(status=ReportJob.FAILED, error="never started", finished_at=now)
+    return expired
+
+
+def recent_jobs(application, model, limit=5):
+    """Latest jobs of a model, after failing the stale ones."""
+    expire_stale_jobs()
+    jobs = AdminJob.objects.filter(application=application, model=model)
+    return list(jobs.order_by("-pk")[:limit])
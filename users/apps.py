@@ -1,6 +1,15 @@
 # -*- coding: utf-8 -*-
 from django.apps import AppConfig
 
+from invoice_gen import settings
+
 
 class UsersConfig(AppConfig):
     name = "users"
+
+    def ready(self):
+        from users import signals  # noqa: F401
+        from users.renderer import warm_up
+
+        if settings.REPORT_WARM_RENDERER:
+            warm_up()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+batch generation of invoice reports for many users
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from itertools import groupby
+from operator import itemgetter
+
+from invoice_gen import settings
+from invoice_gen.settings import logger
+from users import currency
+from users import pricing
+from users import report_cache
+from users.models import Invoice
+from users.renderer import init_worker
+from users.reports import build_report_html
+from users.reports import line_amount
+
+LINE_FIELDS = (
+    "user_id",
+    "id",
+    "updated_at",
+    "name",
+    "line_minor",
+    "unit_price",
+    "quantity",
+    "tax",
+    "discount",
+    "currency",
+)
+
+
+def iter_user_lines(user_ids=None, chunk_size=None):
+    """Yield (user_id, lines) for every user, reading lines in chunks."""
+    lines = Invoice.objects.with_minor_totals().filter(user_id__isnull=False)
+    if user_ids is not None:
+        lines = lines.filter(user_id__in=user_ids)
+    lines = lines.order_by("user_id", "id").values_list(*LINE_FIELDS)
+    chunk_size = chunk_size or settings.REPORT_BATCH_CHUNK_SIZE
+    for user_id, group in groupby(lines.iterator(chunk_size=chunk_size), itemgetter(0)):
+        yield user_id, list(group)
+
+
+def prepare_report(user_id, lines, rates, rates_version):
+    """Return the cache path and html of a user's report."""
+    digest = report_cache.digest(
+        user_id,
+        len(lines),
+        max(line[2] for line in lines),
+        sum(line[1] for line in lines),
+        rates_version,
+    )
+    path = report_cache.cache_path(report_cache.cache_name(user_id, digest))
+    _, *amounts = pricing.line_amounts((line[5:] for line in lines), rates)
+    totals = pricing.summarize(*amounts)
+    rows = ((line[3], line_amount(line[4], line[9])) for line in lines)
+    return path, build_report_html(rows, totals)
+
+
+def generate_reports(user_ids=None, workers=None, chunk_size=None, progress=None):
+    """
+    Render the report of every user (or of user_ids) in a process pool.
+    progress, when given, is called with the stats dict after each report.
+    """
+    workers = workers or settings.REPORT_WORKERS
+    stats = {"users": 0, "rendered": 0, "cached": 0, "failed": 0, "rate": 0.0}
+    started = time.time()
+    rates, rates_version = currency.snapshot()
+
+    def done(future):
+        try:
+            future.result()
+            stats["rendered"] += 1
+        except Exception as ex:
+            logger.error(ex)
+            stats["failed"] += 1
+        elapsed = time.time() - started
+        stats["rate"] = stats["rendered"] / elapsed if elapsed else 0.0
+        if progress:
+            progress(stats)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+    ) as pool:
+        pending = set()
+        for user_id, lines in iter_user_lines(user_ids, chunk_size):
+            stats["users"] += 1
+            path, html_content = prepare_report(user_id, lines, rates, rates_version)
+            if os.path.exists(path):
+                stats["cached"] += 1
+                continue
+            # keep a bounded number of rendered html documents in flight
+            if len(pending) >= workers * 4:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done(future)
+            pending.add(pool.submit(report_cache.write_cached_pdf, html_content, path))
+        for future in wait(pending).done:
+            done(future)
+
+    report_cache.evict()
+    stats["elapsed"] = time.time() - started
+    return stats
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+set-based admin actions: each runs a few UPDATE or DELETE statements over
+chunks of primary keys instead of loading and saving the selected objects
+"""
+import time
+
+from django.db import connection
+from django.db import transaction
+from django.utils import timezone
+
+from authentication import token_cache
+from invoice_gen import settings
+from users import summaries
+from users.fixture_io import invalidate_reports
+from users.ingestion import chunked
+from users.models import APIUser
+from users.models import Invoice
+from users.models import Token
+
+
+def _stats(rows, started):
+    return {"rows": rows, "elapsed": time.time() - started}
+
+
+def _keys(queryset, *fields):
+    # the admin queryset carries annotations and an ordering we don't need
+    return (
+        queryset.order_by()
+        .values_list(*fields)
+        .iterator(chunk_size=settings.ADMIN_ACTION_CHUNK_SIZE)
+    )
+
+
+def delete_invoice_lines(queryset):
+    """
+    Delete the selected lines a chunk at a time, then rebuild the summaries
+    and drop the cached reports of their users. Nothing references Invoice
+    rows, so no cascade has to be collected.
+    """
+    started = time.time()
+    rows = 0
+    user_ids = set()
+    with transaction.atomic():
+        for chunk in chunked(
+            _keys(queryset, "pk", "user_id"), settings.ADMIN_ACTION_CHUNK_SIZE
+        ):
+            Invoice.objects.filter(pk__in=[pk for pk, _ in chunk])._raw_delete(
+                connection.alias
+            )
+            user_ids.update(user_id for _, user_id in chunk)
+            rows += len(chunk)
+        user_ids.discard(None)
+        summaries.rebuild(user_ids)
+        transaction.on_commit(lambda: invalidate_reports(user_ids))
+    return _stats(rows, started)
+
+
+def retax_invoice_lines(queryset, tax):
+    """Move the selected lines to another TAX bracket with one UPDATE."""
+    started = time.time()
+    with transaction.atomic():
+        user_ids = set(queryset.order_by().values_list("user_id", flat=True).distinct())
+        rows = queryset.update(tax=tax, updated_at=timezone.now())
+        user_ids.discard(None)
+        summaries.rebuild(user_ids)
+        transaction.on_commit(lambda: invalidate_reports(user_ids))
+    return _stats(rows, started)
+
+
+def deactivate_users(queryset):
+    """
+    Deactivate the selected users and expire their tokens, dropping the
+    tokens from the cache and revoking them like a new login does.
+    """
+    started = time.time()
+    rows = 0
+    # read the keys first, the selection may filter on is_active itself
+    user_ids = [pk for pk, in _keys(queryset, "pk")]
+    for chunk in chunked(user_ids, settings.ADMIN_ACTION_CHUNK_SIZE):
+        with transaction.atomic():
+            rows += APIUser.objects.filter(pk__in=chunk).update(is_active=False)
+            tokens = Token.objects.filter(user_id__in=chunk, is_expired=False)
+            active_tokens = list(tokens.values_list("access_token", "refresh_token"))
+            tokens.update(is_expired=True, updated_at=timezone.now())
+        token_cache.expire_pairs(active_tokens)
+    token_cache.revocations_changed()
+    return _stats(rows, started)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+process local copy of the CurrencyRate table
+"""
+import threading
+import time
+from decimal import Decimal
+
+from invoice_gen import settings
+from users.models import CurrencyRate
+
+_lock = threading.Lock()
+_rates = None
+_version = None
+_loaded_at = 0
+
+
+def snapshot():
+    """Return rates() and their version: the row count and last update."""
+    global _rates, _version, _loaded_at
+    with _lock:
+        if _rates is None or time.time() - _loaded_at > settings.CURRENCY_RATE_TTL:
+            rows = list(
+                CurrencyRate.objects.values_list("currency", "rate", "updated_at")
+            )
+            table = {code: rate for code, rate, _ in rows}
+            table[settings.BASE_CURRENCY] = Decimal(1)
+            last_update = max((updated_at for _, _, updated_at in rows), default=None)
+            _rates = table
+            _version = "%s@%s" % (
+                len(rows),
+                last_update.isoformat() if last_update else "",
+            )
+            _loaded_at = time.time()
+        return _rates, _version
+
+
+def rates():
+    """Return {currency: rate to settings.BASE_CURRENCY}, reloaded after a ttl."""
+    return snapshot()[0]
+
+
+def version():
+    """Version of the rates returned by rates(), for cache keys."""
+    return snapshot()[1]
+
+
+def invalidate():
+    """Drop this process's copy, e.g. after a rate was edited."""
+    global _rates
+    with _lock:
+        _rates = None
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+streaming export of a model to a dumpdata compatible json fixture, and bulk
+loading of invoice fixtures, optionally gzip or zstd compressed
+"""
+import gzip
+import io
+import json
+import os
+import shutil
+import time
+import zlib
+
+from django.core import serializers
+from django.core.management.color import no_style
+from django.db import connection
+from django.db import transaction
+
+from invoice_gen import settings
+from users import report_cache
+from users import summaries
+from users.ingestion import chunked
+from users.models import APIUser
+from users.models import CurrencyRate
+from users.models import Invoice
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for .zst fixtures
+    zstandard = None
+
+COMPRESSIONS = ("gz", "zst") if zstandard else ("gz",)
+
+
+def compressor(compression):
+    """Return an object with compress() and flush(), or None for plain json."""
+    if not compression:
+        return None
+    if compression == "gz":
+        # wbits 16 + 15 writes a gzip header and trailer
+        return zlib.compressobj(wbits=31)
+    if compression == "zst" and zstandard:
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError("unsupported fixture compression %s" % compression)
+
+
+def fixture_compression(path):
+    extension = path.rsplit(".", 1)[-1]
+    return extension if extension in ("gz", "zst") else None
+
+
+def iter_fixture(queryset, chunk_size=None, stats=None, progress=None):
+    """
+    Yield the text of a dumpdata --indent 2 fixture of queryset, serializing
+    chunk_size objects at a time. stats["rows"] counts the objects written;
+    progress, when given, is called with stats after each chunk.
+    """
+    chunk_size = chunk_size or settings.FIXTURE_CHUNK_SIZE
+    serializer = serializers.get_serializer("json")()
+    objects = queryset.order_by("pk").iterator(chunk_size=chunk_size)
+    yield "["
+    separator = ""
+    for chunk in chunked(objects, chunk_size):
+        # every chunk serializes as "[<objects>\n]\n", keep only the objects
+        text = serializer.serialize(chunk, indent=2)
+        yield separator + text[1:-3]
+        separator = ","
+        if stats is not None:
+            stats["rows"] = stats.get("rows", 0) + len(chunk)
+            if progress:
+                progress(stats)
+    yield "\n]\n"
+
+
+def iter_export(queryset, compression=None, chunk_size=None, stats=None, progress=None):
+    """Yield the fixture of queryset as bytes, compressed when asked to."""
+    packer = compressor(compression)
+    for text in iter_fixture(queryset, chunk_size, stats, progress):
+        data = text.encode("utf8")
+        if packer is not None:
+            data = packer.compress(data)
+        if data:
+            yield data
+    if packer is not None:
+        yield packer.flush()
+
+
+def dump_fixture(queryset, path, chunk_size=None, stats=None, progress=None):
+    """
+    Write the fixture of queryset to path, compressed by its .gz or .zst
+    extension, and return the number of objects written. stats["rows"] is
+    kept up to date while the fixture is written and passed to progress.
+    """
+    stats = {} if stats is None else stats
+    stats["rows"] = 0
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, "wb") as f:
+        for data in iter_export(
+            queryset, fixture_compression(path), chunk_size, stats, progress
+        ):
+            f.write(data)
+    os.replace(tmp_path, path)
+    return stats["rows"]
+
+
+def link_backup(path, backup_path):
+    """Make backup_path a hardlink of path, or a copy across filesystems."""
+    if os.path.exists(backup_path):
+        os.remove(backup_path)
+    try:
+        os.link(path, backup_path)
+    except OSError:
+        shutil.copyfile(path, backup_path)
+
+
+def find_fixture(directory, name):
+    """Return the path of name.json, .json.gz or .json.zst in directory."""
+    for extension in ("json", "json.gz", "json.zst"):
+        path = os.path.join(directory, "%s.%s" % (name, extension))
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def open_fixture(path):
+    """Open a .json, .json.gz or .json.zst fixture for reading text."""
+    compression = fixture_compression(path)
+    if compression == "gz":
+        return gzip.open(path, "rt", encoding="utf8")
+    if compression == "zst":
+        if zstandard is None:
+            raise ValueError("reading %s needs the zstandard package" % path)
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(reader, encoding="utf8")
+    return open(path, encoding="utf8")
+
+
+def iter_fixture_objects(stream, read_size=64 * 1024):
+    """
+    Yield the objects of a json array read from a text stream, parsing each
+    one as soon as it is complete instead of loading the whole document.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    eof = False
+    while True:
+        # skip whitespace, the opening bracket and the separating commas
+        while position < len(buffer) and buffer[position] in " \t\r\n,[":
+            if buffer[position] == "[":
+                started = True
+            position += 1
+        if position < len(buffer) and buffer[position] == "]" and started:
+            return
+        try:
+            if position >= len(buffer):
+                raise ValueError("need more data")
+            obj, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                if buffer[position:].strip():
+                    raise ValueError("truncated fixture")
+                return
+            data = stream.read(read_size)
+            eof = not data
+            buffer = buffer[position:] + data
+            position = 0
+            continue
+        yield obj
+
+
+def _write(objs, existing):
+    """
+    Save fixture objs with the bulk APIs, keeping their pks and timestamps
+    like loaddata does: the rows in existing are updated in place, the
+    others created. No signals are sent, the callers refresh what depends
+    on the lines.
+    """
+    fields = [field.name for field in Invoice._meta.concrete_fields]
+    replaced = [obj for obj in objs if obj.pk in existing]
+    if replaced:
+        Invoice.objects.bulk_update(
+            replaced, [name for name in fields if name != Invoice._meta.pk.name]
+        )
+    created = [obj for obj in objs if obj.pk not in existing]
+    # bulk_create stamps auto_now and auto_now_add fields with the current time
+    stamps = [(obj.created_at, obj.updated_at) for obj in created]
+    Invoice.objects.bulk_create(created)
+    restored = []
+    for obj, (created_at, updated_at) in zip(created, stamps):
+        if obj.pk is not None:
+            obj.created_at, obj.updated_at = created_at, updated_at
+            restored.append(obj)
+    if restored:
+        Invoice.objects.bulk_update(restored, ["created_at", "updated_at"])
+
+
+def invalidate_reports(user_ids):
+    for user_id in user_ids:
+        report_cache.invalidate(user_id)
+
+
+def load_invoice_fixture(path, chunk_size=None, stats=None, progress=None):
+    """
+    Load an Invoice fixture in one transaction, chunk_size objects at a time:
+    the users and currencies referenced by a chunk are checked, objects whose
+    pk exists are updated and the others bulk inserted. Summaries and
+    cached reports of the touched users are refreshed afterwards.
+    Returns rows, created, updated, elapsed and rate (rows per second), in
+    stats when given, which is updated after every chunk and passed to
+    progress.
+    """
+    chunk_size = chunk_size or settings.FIXTURE_CHUNK_SIZE
+    label = Invoice._meta.label_lower
+    stats = {} if stats is None else stats
+    stats.update(rows=0, created=0, updated=0)
+    user_ids = set()
+    started = time.time()
+    with open_fixture(path) as stream, transaction.atomic():
+        for chunk in chunked(iter_fixture_objects(stream), chunk_size):
+            models = {obj.get("model") for obj in chunk}
+            if models != {label}:
+                raise ValueError("not an %s fixture: %s" % (label, sorted(models)))
+            objs = [item.object for item in serializers.deserialize("python", chunk)]
+
+            referenced = {obj.user_id_id for obj in objs} - {None}
+            found = set(
+                APIUser.objects.filter(pk__in=referenced).values_list("pk", flat=True)
+            )
+            if referenced - found:
+                raise ValueError(
+                    "fixture references missing users %s" % sorted(referenced - found)
+                )
+
+            currencies = {obj.currency for obj in objs}
+            unknown = {code for code in currencies if not CurrencyRate.is_known(code)}
+            if unknown:
+                raise ValueError(
+                    "fixture references unknown currencies %s" % sorted(unknown)
+                )
+
+            existing = dict(
+                Invoice.objects.filter(pk__in=[obj.pk for obj in objs]).values_list(
+                    "pk", "user_id"
+                )
+            )
+            # the summaries are rebuilt below, so no save signals are needed
+            _write(objs, existing)
+
+            user_ids.update(referenced, existing.values())
+            stats["rows"] += len(objs)
+            stats["created"] += len(objs) - len(existing)
+            stats["updated"] += len(existing)
+            if progress:
+                progress(stats)
+
+        # explicit pks leave the id sequence behind on postgres
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Invoice]):
+                cursor.execute(sql)
+        user_ids.discard(None)
+        summaries.rebuild(user_ids)
+        transaction.on_commit(lambda: invalidate_reports(user_ids))
+    stats["elapsed"] = time.time() - started
+    stats["rate"] = stats["rows"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    return stats
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+validated, chunked insertion of invoice lines
+"""
+import csv
+import hashlib
+import io
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from invoice_gen import settings
+from users import report_cache
+from users import summaries
+from users.models import Invoice
+from users.serializers import InvoiceLineSerializer
+
+UPSERT_FIELDS = [
+    "name",
+    "quantity",
+    "unit_price",
+    "tax",
+    "discount",
+    "currency",
+    "updated_at",
+]
+
+
+def chunked(rows, size):
+    """Yield lists of at most size rows from any iterable."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_csv_rows(stream):
+    """Yield a dict per csv record of a binary stream, skipping empty cells."""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    for record in reader:
+        yield {key: value for key, value in record.items() if key and value != ""}
+
+
+def iter_ndjson_rows(stream):
+    """Yield the object of every non blank line of a binary ndjson stream."""
+    for raw in io.TextIOWrapper(stream, encoding="utf-8"):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            yield json.loads(raw)
+        except ValueError:
+            # handed on as is so the serializer rejects it with its line number
+            yield raw
+
+
+UPLOAD_FORMATS = {"csv": iter_csv_rows, "ndjson": iter_ndjson_rows}
+
+
+def upload_format(name, requested=None):
+    """Pick the upload format from the request or the file extension."""
+    if requested:
+        return requested if requested in UPLOAD_FORMATS else None
+    extension = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    if extension in ("ndjson", "jsonl"):
+        return "ndjson"
+    if extension == "csv":
+        return "csv"
+    return None
+
+
+def line_key(idempotency_key, line):
+    """Key of a line without its own line_key in an idempotent request."""
+    raw = "%s:%s" % (idempotency_key, line)
+    return hashlib.sha256(raw.encode("utf8")).hexdigest()
+
+
+def save_lines(lines, user_id):
+    """
+    Insert lines, updating instead the user's existing lines that have the
+    same line_key. Returns the inserted and the updated lines.
+    """
+    keyed = {}
+    new_lines = []
+    for invoice in lines:
+        if invoice.line_key:
+            # the last line wins when a key repeats within the chunk
+            keyed[invoice.line_key] = invoice
+        else:
+            new_lines.append(invoice)
+
+    existing = dict(
+        Invoice.objects.filter(user_id=user_id, line_key__in=keyed).values_list(
+            "line_key", "pk"
+        )
+    )
+    now = timezone.now()
+    updates = []
+    for key, invoice in keyed.items():
+        if key in existing:
+            invoice.pk = existing[key]
+            invoice.updated_at = now
+            updates.append(invoice)
+        else:
+            new_lines.append(invoice)
+
+    Invoice.objects.bulk_create(new_lines)
+    Invoice.objects.bulk_update(updates, UPSERT_FIELDS)
+    return new_lines, updates
+
+
+def ingest_invoice_lines(
+    rows, user_id, chunk_size=None, max_errors=None, idempotency_key=None
+):
+    """
+    Validate rows against InvoiceLineSerializer and save the valid ones for
+    user_id, one chunk of model instances at a time, in a single transaction.
+    Lines with a line_key, or every line when an idempotency_key is given,
+    are upserted so a retried request does not duplicate them.
+    Returns the inserted, updated and rejected counts, the rejected rows and
+    their errors (at most max_errors of them when given).
+    """
+    chunk_size = chunk_size or settings.INVOICE_INGEST_CHUNK_SIZE
+    result = {
+        "inserted": 0,
+        "updated": 0,
+        "rejected": 0,
+        "error_lines": [],
+        "errors": [],
+    }
+    serializer = InvoiceLineSerializer()
+    line = 0
+    delta = {}
+    with transaction.atomic():
+        for chunk in chunked(rows, chunk_size):
+            lines = []
+            for data in chunk:
+                try:
+                    validated = serializer.run_validation(data)
+                except ValidationError as ex:
+                    result["rejected"] += 1
+                    if max_errors is None or len(result["errors"]) < max_errors:
+                        result["error_lines"].append(data)
+                        result["errors"].append({"line": line, "errors": ex.detail})
+                else:
+                    if idempotency_key and not validated.get("line_key"):
+                        validated["line_key"] = line_key(idempotency_key, line)
+                    lines.append(Invoice(user_id_id=user_id, **validated))
+                line += 1
+            inserted, updated = save_lines(lines, user_id)
+            result["inserted"] += len(inserted)
+            result["updated"] += len(updated)
+            if not result["updated"]:
+                summaries.line_amounts(inserted, delta)
+        if result["updated"]:
+            # the previous amounts of upserted lines are unknown, start over
+            summaries.rebuild([user_id])
+        else:
+            summaries.apply_delta(user_id, delta)
+        transaction.on_commit(lambda: report_cache.invalidate(user_id))
+    return result
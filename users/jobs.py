@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+process pool used to render invoice reports outside the request thread
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.utils import timezone
+
+from invoice_gen import settings
+from invoice_gen.settings import logger
+from users import report_cache
+from users.models import ReportJob
+from users.renderer import init_worker
+from users.reports import write_report_pdf
+
+_pool = None
+
+
+def get_pool():
+    """Return the report pool, starting it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.REPORT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+    return _pool
+
+
+def _update_job(job_id, **fields):
+    ReportJob.objects.filter(pk=job_id).update(updated_at=timezone.now(), **fields)
+
+
+def submit_report(user_id):
+    """Queue a report for user_id and return its ReportJob."""
+    name = report_cache.cached_report(user_id)
+    if name:
+        return ReportJob.objects.create(
+            user_id_id=user_id, status=ReportJob.DONE, file_name=name
+        )
+
+    job = ReportJob.objects.create(user_id_id=user_id)
+    try:
+        get_pool().submit(run_report_job, job.pk)
+    except Exception as ex:
+        logger.error(ex)
+        _update_job(job.pk, status=ReportJob.FAILED, error=str(ex))
+        job.refresh_from_db()
+    return job
+
+
+def run_report_job(job_id):
+    """Render the pdf of a queued job, runs inside a pool worker."""
+    job = ReportJob.objects.get(pk=job_id)
+    _update_job(job_id, status=ReportJob.RUNNING)
+    try:
+        name = report_cache.get_or_render(
+            job.user_id_id, partial(write_report_pdf, job.user_id_id)
+        )
+    except Exception as ex:
+        logger.error(ex)
+        _update_job(job_id, status=ReportJob.FAILED, error=str(ex))
+        return
+    _update_job(job_id, status=ReportJob.DONE, file_name=name)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from jwt_utils.digest import token_digest
+from users.models import Token
+
+
+class Command(BaseCommand):
+    help = "Fill the access/refresh token digests of Token rows created before them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        missing = Token.objects.filter(
+            Q(access_token__isnull=False, access_token_digest__isnull=True)
+            | Q(refresh_token__isnull=False, refresh_token_digest__isnull=True)
+        ).order_by("pk")
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(
+                missing.filter(pk__gt=last_pk).only(
+                    "pk", "access_token", "refresh_token"
+                )[:batch_size]
+            )
+            if not batch:
+                break
+            for token in batch:
+                token.access_token_digest = token_digest(token.access_token)
+                token.refresh_token_digest = token_digest(token.refresh_token)
+            Token.objects.bulk_update(
+                batch, ["access_token_digest", "refresh_token_digest"]
+            )
+            last_pk = batch[-1].pk
+            updated += len(batch)
+        self.stdout.write(self.style.SUCCESS("%s tokens updated" % updated))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import time
+from datetime import datetime
+from datetime import timedelta
+
+import jwt
+from django.core.management.base import BaseCommand
+
+from invoice_gen import settings
+from jwt_utils.codec import default_codec
+from jwt_utils.encryption import AESCipher
+
+FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def legacy_encode(user_id, jwt_ttl, token_type, is_admin):
+    """The token generator as it was before TokenCodec, kept for comparison."""
+    current_time = datetime.now()
+    issued = current_time.strftime(FORMAT)
+    exp_at = (current_time + timedelta(milliseconds=jwt_ttl)).strftime(FORMAT)
+    payload = {
+        "user_id": user_id,
+        "is_admin": is_admin,
+        "type": token_type,
+        "issued_at": issued,
+        "exp": datetime.strptime(exp_at, FORMAT).timestamp(),
+    }
+    token = jwt.encode(payload, settings.JWT_SECRET, settings.JWT_ALGORITHM)
+    return AESCipher().encrypt_token(token)
+
+
+def legacy_decode(token):
+    decoded = AESCipher().decrypt_token(token)
+    return jwt.decode(
+        decoded,
+        settings.JWT_SECRET,
+        algorithm=settings.JWT_ALGORITHM,
+        options={"verify_exp": True},
+    )
+
+
+class Command(BaseCommand):
+    help = "Measure tokens per second of the legacy token path and TokenCodec."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        count = options["count"]
+        claims = [(i, settings.TOKEN_EXPIRY, "access", False) for i in range(count)]
+
+        legacy_tokens = self.measure(
+            "legacy encode", lambda: [legacy_encode(*claim) for claim in claims]
+        )
+        self.measure("legacy decode", lambda: [legacy_decode(t) for t in legacy_tokens])
+        tokens = self.measure("codec encode", lambda: default_codec.encode_many(claims))
+        self.measure("codec decode", lambda: default_codec.decode_many(tokens))
+
+    def measure(self, label, run):
+        started = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            "%-14s %10.0f tokens/s" % (label, len(result) / elapsed if elapsed else 0)
+        )
+        return result
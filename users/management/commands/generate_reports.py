@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from users.batch import generate_reports
+
+
+class Command(BaseCommand):
+    help = "Render the invoice report of many users in a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="user_ids", help="user id"
+        )
+        parser.add_argument("--workers", type=int, help="parallel renderers")
+        parser.add_argument("--chunk-size", type=int, help="lines read per query")
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            finished = stats["rendered"] + stats["failed"]
+            if finished % 100 == 0:
+                self.stdout.write(
+                    "%(rendered)s rendered, %(failed)s failed, "
+                    "%(rate).1f pdf/s" % stats
+                )
+
+        stats = generate_reports(
+            user_ids=options["user_ids"],
+            workers=options["workers"],
+            chunk_size=options["chunk_size"],
+            progress=progress,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "%(users)s users: %(rendered)s rendered, %(cached)s cached, "
+                "%(failed)s failed in %(elapsed).1fs (%(rate).1f pdf/s)" % stats
+            )
+        )
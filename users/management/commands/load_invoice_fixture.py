@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from users.fixture_io import load_invoice_fixture
+
+
+class Command(BaseCommand):
+    help = "Bulk load an Invoice fixture (.json, .json.gz or .json.zst)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="fixture file")
+        parser.add_argument("--chunk-size", type=int, help="objects per batch")
+
+    def handle(self, *args, **options):
+        stats = load_invoice_fixture(options["path"], options["chunk_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                "%(rows)s rows (%(created)s created, %(updated)s updated) "
+                "in %(elapsed).2fs, %(rate).0f rows/s" % stats
+            )
+        )
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.core.management.base import BaseCommand
+
+from authentication.sweeper import prune_tokens
+from authentication.token_cache import prune_revoked
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired, revoked and past-exp Token rows in batches, and "
+        "revocations past their token's exp."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, help="rows deleted per batch")
+        parser.add_argument("--max-batches", type=int, help="stop after N batches")
+
+    def handle(self, *args, **options):
+        started = time.time()
+        removed = prune_tokens(options["batch_size"], options["max_batches"])
+        revoked = prune_revoked()
+        self.stdout.write(
+            self.style.SUCCESS(
+                "%s tokens and %s revocations removed in %.2fs"
+                % (removed, revoked, time.time() - started)
+            )
+        )
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.summaries import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the per user invoice summaries from the invoice lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument("user_ids", nargs="*", type=int, help="only these users")
+
+    def handle(self, *args, **options):
+        started = time.time()
+        rebuilt = rebuild(options["user_ids"] or None)
+        self.stdout.write(
+            self.style.SUCCESS(
+                "%s summaries rebuilt in %.2fs" % (rebuilt, time.time() - started)
+            )
+        )
@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
+from datetime import timedelta
+
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Count
+from django.db.models import Q
+from django.db.models import Sum
 from django.utils import timezone
 
 from invoice_gen import settings
+from jwt_utils.digest import token_digest
+from users import pricing
+from users.pricing import summarize
+from utils.message_utils import get_message
 
 # Create your models here.
 
@@ -93,16 +103,86 @@ class APIUser(AbstractBaseUser, PermissionsMixin):
         return self.first_name
 
 
+class TokenQuerySet(models.QuerySet):
+    def stale(self, now=None):
+        """Tokens that are expired or past the exp of both their jwts."""
+        now = now or timezone.now()
+        ttl = max(settings.TOKEN_EXPIRY, settings.REFRESH_TOKEN_EXPIRY)
+        cutoff = now - timedelta(milliseconds=ttl)
+        return self.filter(Q(is_expired=True) | Q(created_at__lt=cutoff))
+
+
 class Token(models.Model):
     user_id = models.ForeignKey(
         APIUser, blank=True, null=True, on_delete=models.CASCADE
     )
     refresh_token = models.TextField(blank=True, null=True)
     access_token = models.TextField(blank=True, null=True)
+    refresh_token_digest = models.CharField(
+        max_length=64, blank=True, null=True, db_index=True
+    )
+    access_token_digest = models.CharField(
+        max_length=64, blank=True, null=True, db_index=True
+    )
     is_expired = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TokenQuerySet.as_manager()
+
+    class Meta:
+        # login looks up and expires the active tokens of a user
+        indexes = [
+            models.Index(fields=["user_id", "is_expired"], name="token_user_expired")
+        ]
+
+    def save(self, *args, **kwargs):
+        self.refresh_token_digest = token_digest(self.refresh_token)
+        self.access_token_digest = token_digest(self.access_token)
+        super().save(*args, **kwargs)
+
+
+class RevokedToken(models.Model):
+    """
+    Id of a signed jwt revoked before its exp. Kept in the database rather
+    than a cache, which may evict entries, and pruned once past expires_at.
+    """
+
+    jti = models.CharField(max_length=32, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class InvoiceQuerySet(models.QuerySet):
+    """Invoice arithmetic evaluated by the database."""
+
+    def with_minor_totals(self):
+        """Annotate line_minor, line_tax_fixed and line_discount_fixed integers."""
+        return self.annotate(line_minor=pricing.minor_total_expression()).annotate(
+            line_tax_fixed=pricing.fixed_percent_expression("line_minor", "tax"),
+            line_discount_fixed=pricing.fixed_percent_expression(
+                "line_minor", "discount"
+            ),
+        )
+
+    def currency_totals(self):
+        """Line count and integer sums per currency, in one grouped query."""
+        return (
+            self.with_minor_totals()
+            .order_by()
+            .values_list("currency")
+            .annotate(
+                Count("id"),
+                Sum("line_minor"),
+                Sum("line_tax_fixed"),
+                Sum("line_discount_fixed"),
+            )
+        )
+
+    def fixed_totals(self, rates):
+        """Report totals in fixed units of the base currency."""
+        _, *amounts = pricing.fixed_totals(self.currency_totals(), rates)
+        return summarize(*amounts)
+
 
 class Invoice(models.Model):
     TAX = [
@@ -122,26 +202,178 @@ class Invoice(models.Model):
     )
     tax = models.IntegerField(null=True, blank=True, choices=TAX, default=0)
     discount = models.IntegerField(null=True, blank=True)
+    currency = models.CharField(max_length=3, default=settings.BASE_CURRENCY)
+    # client supplied key making re-posted lines update instead of duplicate
+    line_key = models.CharField(max_length=64, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = InvoiceQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user_id", "line_key"], name="unique_invoice_line_key"
+            )
+        ]
+        # the listing api seeks on (created_at, id) within a user, optionally
+        # narrowed to a tax bracket or a name prefix; the admin change list
+        # browses all users by date, optionally within a tax bracket or a
+        # currency
+        indexes = [
+            models.Index(
+                fields=["user_id", "created_at", "id"], name="invoice_user_created"
+            ),
+            models.Index(
+                fields=["user_id", "tax", "created_at", "id"],
+                name="invoice_user_tax_created",
+            ),
+            models.Index(fields=["user_id", "name"], name="invoice_user_name"),
+            models.Index(fields=["created_at"], name="invoice_created"),
+            models.Index(fields=["tax", "created_at"], name="invoice_tax_created"),
+            models.Index(
+                fields=["currency", "created_at"], name="invoice_currency_created"
+            ),
+        ]
+
     def __str__(self):
         return str(self.id).zfill(2) + "|" + self.name
 
+    def clean(self):
+        # totals of a line need the rate of its currency
+        self.currency = (self.currency or "").upper()
+        if not CurrencyRate.is_known(self.currency):
+            raise ValidationError({"currency": get_message(331)})
+
     @property
     def total_price(self):
-        return self.unit_price * self.quantity
+        return pricing.line_total(self.unit_price, self.quantity)
 
     @property
     def tax_amount(self):
-        if self.tax:
-            return (self.total_price * self.tax) / 100
-        else:
-            return 0
+        return pricing.percent_of(self.total_price, self.tax)
 
     @property
     def discount_amount(self):
-        if self.discount:
-            return (self.total_price * self.discount) / 100
-        else:
-            return 0
+        return pricing.percent_of(self.total_price, self.discount)
+
+    @property
+    def price_columns(self):
+        return self.unit_price, self.quantity, self.tax, self.discount, self.currency
+
+
+class CurrencyRate(models.Model):
+    """Value of one unit of currency in settings.BASE_CURRENCY."""
+
+    currency = models.CharField(max_length=3, unique=True)
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s %s" % (self.currency, self.rate)
+
+    @classmethod
+    def is_known(cls, currency):
+        return (
+            currency == settings.BASE_CURRENCY
+            or cls.objects.filter(currency=currency).exists()
+        )
+
+    def in_use(self):
+        """True while invoice lines are priced in this currency."""
+        return Invoice.objects.filter(currency=self.currency).exists()
+
+    def delete(self, *args, **kwargs):
+        if self.in_use():
+            raise models.ProtectedError(
+                "%s is the currency of invoice lines" % self.currency,
+                Invoice.objects.filter(currency=self.currency),
+            )
+        return super().delete(*args, **kwargs)
+
+
+class InvoiceSummary(models.Model):
+    """
+    Per user and currency running sums of the invoice lines, unconverted:
+    minor units for the sub total, fixed units for tax and discount. They are
+    converted when read, like the report, see users/summaries.py.
+    """
+
+    user_id = models.ForeignKey(APIUser, on_delete=models.CASCADE)
+    currency = models.CharField(max_length=3)
+    line_count = models.IntegerField(default=0)
+    minor_total = models.BigIntegerField(default=0)
+    tax_fixed = models.BigIntegerField(default=0)
+    discount_fixed = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user_id", "currency"], name="unique_summary_currency"
+            )
+        ]
+
+
+class ReportJob(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS = [
+        (PENDING, PENDING),
+        (RUNNING, RUNNING),
+        (DONE, DONE),
+        (FAILED, FAILED),
+    ]
+
+    user_id = models.ForeignKey(
+        APIUser, blank=True, null=True, on_delete=models.CASCADE
+    )
+    status = models.CharField(max_length=10, choices=STATUS, default=PENDING)
+    file_name = models.CharField(max_length=255, blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class AdminJob(models.Model):
+    """A dumpdata or loaddata run started from the admin, see users/admin_jobs.py."""
+
+    DUMPDATA = "dumpdata"
+    LOADDATA = "loaddata"
+    KINDS = [
+        (DUMPDATA, DUMPDATA),
+        (LOADDATA, LOADDATA),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    application = models.CharField(max_length=100)
+    model = models.CharField(max_length=100)
+    compression = models.CharField(max_length=4, blank=True, null=True)
+    status = models.CharField(
+        max_length=10, choices=ReportJob.STATUS, default=ReportJob.PENDING
+    )
+    rows = models.IntegerField(default=0)
+    file_name = models.CharField(max_length=255, blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    created_by = models.ForeignKey(
+        APIUser, blank=True, null=True, on_delete=models.SET_NULL
+    )
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def duration(self):
+        """Seconds spent running so far, None before the job starts."""
+        if self.started_at is None:
+            return None
+        end = self.finished_at or timezone.now()
+        return (end - self.started_at).total_seconds()
+
+    @property
+    def rows_per_second(self):
+        duration = self.duration
+        return self.rows / duration if duration else None
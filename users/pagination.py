@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+keyset pagination of invoice lines on (created_at, id), newest first, and an
+admin paginator that estimates the size of large unfiltered tables
+"""
+import base64
+from urllib import parse
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+from invoice_gen import settings
+from utils.message_utils import get_message
+
+
+def encode_cursor(created_at, pk):
+    raw = "%s|%s" % (created_at.isoformat(), pk)
+    return base64.urlsafe_b64encode(raw.encode("utf8")).decode()
+
+
+def decode_cursor(cursor):
+    """Return the (created_at, id) position of a cursor, raising on bad ones."""
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor).decode().split("|")
+        position = parse_datetime(created_at), int(pk)
+    except ValueError:
+        position = None, None
+    if position[0] is None:
+        raise ParseError({"code": 329, "message": get_message(329)})
+    return position
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages through a queryset by seeking past the last row of the previous
+    page, so every page costs one index range scan whatever its depth.
+    """
+
+    ordering = ("-created_at", "-id")
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.INVOICE_PAGE_SIZE
+        return min(max(size, 1), settings.INVOICE_MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, pk = decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+        # one extra row tells whether a next page exists
+        rows = list(queryset.order_by(*self.ordering)[: page_size + 1])
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_cursor = encode_cursor(rows[-1].created_at, rows[-1].pk)
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        scheme, netloc, path, query, fragment = parse.urlsplit(url)
+        params = parse.parse_qs(query, keep_blank_values=True)
+        params[self.cursor_query_param] = [self.next_cursor]
+        query = parse.urlencode(sorted(params.items()), doseq=True)
+        return parse.urlunsplit((scheme, netloc, path, query, fragment))
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "code": 200,
+                "message": get_message(200),
+                "next": self.get_next_link(),
+                "cursor": self.next_cursor,
+                "results": data,
+            }
+        )
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin paginator using the planner's row estimate instead of COUNT(*) for
+    an unfiltered table of at least ADMIN_ESTIMATED_COUNT_THRESHOLD rows.
+    Only postgres keeps such an estimate, other backends always count.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is not None and not query.where:
+            estimate = self.estimate(self.object_list)
+            if (
+                estimate is not None
+                and estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD
+            ):
+                return estimate
+        return super().count
+
+    @staticmethod
+    def estimate(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+the invoice pricing rules, in one place: scalar functions for single lines,
+column-wise sums for batches of lines and the matching SQL expressions for
+querysets. Invoice properties, annotations, summaries and reports all use
+these so they cannot drift apart.
+
+Totals are computed in integers: line totals in minor units (cents) and tax
+and discount amounts in fixed units of 1/10000, which hold an integer percent
+of a cent amount exactly. Amounts become Decimals only when formatted.
+"""
+from decimal import Decimal
+from decimal import ROUND_HALF_UP
+
+from django.db import models
+from django.db.models import ExpressionWrapper
+from django.db.models import F
+from django.db.models.functions import Cast
+from django.db.models.functions import Coalesce
+from django.db.models.functions import Round
+
+# minor units per currency unit, fixed units per minor unit
+MINOR = 100
+FIXED_PLACES = 4
+FIXED_PER_MINOR = 10**FIXED_PLACES // MINOR
+
+
+def line_total(unit_price, quantity):
+    """unit_price * quantity, None when either is missing (NULL in SQL)."""
+    if unit_price is None or quantity is None:
+        return None
+    return unit_price * quantity
+
+
+def percent_of(amount, rate):
+    """rate percent of amount, 0 for no rate or no amount."""
+    if not rate or amount is None:
+        return 0
+    return amount * rate / 100
+
+
+def _round(value):
+    return int(Decimal(value).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_minor(amount):
+    """Whole minor units of a Decimal amount."""
+    return _round(Decimal(amount).scaleb(2))
+
+
+def from_minor(units):
+    """Decimal value of an amount in minor units."""
+    return Decimal(units).scaleb(-2)
+
+
+def from_fixed(units):
+    """Decimal value of an amount in fixed units."""
+    return Decimal(units).scaleb(-FIXED_PLACES)
+
+
+def convert(sub_total, tax_total, discount_total, rate):
+    """
+    Convert the fixed unit totals of one currency to the base currency.
+    The sub total stays a whole number of minor units.
+    """
+    if rate == 1:
+        return sub_total, tax_total, discount_total
+    minor = _round(Decimal(sub_total // FIXED_PER_MINOR) * rate)
+    return (
+        minor * FIXED_PER_MINOR,
+        _round(tax_total * rate),
+        _round(discount_total * rate),
+    )
+
+
+def fixed_totals(groups, rates):
+    """
+    Sum (currency, count, minor sub total, fixed tax, fixed discount) groups
+    into the line count and base currency sub total, tax and discount in
+    fixed units. Each currency is converted once, not once per line.
+    """
+    count = sub_total = tax_total = discount_total = 0
+    for currency, lines, minor, tax, discount in groups:
+        try:
+            rate = rates[currency]
+        except KeyError:
+            raise ValueError("no exchange rate for %s" % currency)
+        converted = convert(
+            (minor or 0) * FIXED_PER_MINOR, tax or 0, discount or 0, rate
+        )
+        count += lines
+        sub_total += converted[0]
+        tax_total += converted[1]
+        discount_total += converted[2]
+    return count, sub_total, tax_total, discount_total
+
+
+def currency_groups(lines, groups=None):
+    """
+    Sum (unit_price, quantity, tax, discount, currency) tuples into
+    {currency: [count, minor sub total, fixed tax, fixed discount]}, adding
+    to groups when given. Nothing is converted or rounded.
+    """
+    groups = {} if groups is None else groups
+    for unit_price, quantity, tax, discount, currency in lines:
+        group = groups.setdefault(currency, [0, 0, 0, 0])
+        group[0] += 1
+        if unit_price is None or quantity is None:
+            continue
+        minor = to_minor(unit_price) * quantity
+        group[1] += minor
+        group[2] += minor * (tax or 0)
+        group[3] += minor * (discount or 0)
+    return groups
+
+
+def line_amounts(lines, rates):
+    """
+    Sum (unit_price, quantity, tax, discount, currency) tuples into the line
+    count and the base currency sub total, tax and discount in fixed units.
+    """
+    groups = currency_groups(lines)
+    return fixed_totals(
+        ((currency, *group) for currency, group in groups.items()), rates
+    )
+
+
+def summarize(sub_total, tax_total, discount_total):
+    """Build the report totals from the summed line amounts."""
+    sub_total_tax = sub_total + tax_total
+    return {
+        "sub_total": sub_total,
+        "tax_total": tax_total,
+        "discount_total": discount_total,
+        "sub_total_tax": sub_total_tax,
+        "final_amount": sub_total_tax - discount_total,
+    }
+
+
+def minor_total_expression():
+    """unit_price * quantity in minor units, as an integer column."""
+    unit_price = Cast(Round(F("unit_price") * MINOR), models.BigIntegerField())
+    return ExpressionWrapper(
+        unit_price * F("quantity"), output_field=models.BigIntegerField()
+    )
+
+
+def fixed_percent_expression(minor, rate):
+    """rate percent of a minor unit column, in fixed units."""
+    return ExpressionWrapper(
+        F(minor) * Coalesce(F(rate), 0), output_field=models.BigIntegerField()
+    )
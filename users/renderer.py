@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+weasyprint renderer kept warm for the lifetime of a process
+"""
+import os
+import threading
+
+from invoice_gen import settings
+from invoice_gen.settings import logger
+
+STYLESHEET = os.path.join(settings.BASE_DIR, "users", "style.css")
+
+_renderer = None
+_lock = threading.Lock()
+
+
+class PdfRenderer(object):
+    """Holds the parsed report stylesheet and font configuration."""
+
+    def __init__(self, stylesheet=STYLESHEET):
+        from weasyprint import CSS, HTML
+
+        try:
+            from weasyprint.text.fonts import FontConfiguration
+        except ImportError:
+            from weasyprint.fonts import FontConfiguration
+
+        self.html_class = HTML
+        self.font_config = FontConfiguration()
+        self.stylesheet = CSS(filename=stylesheet, font_config=self.font_config)
+
+    def write_pdf(self, html_content, target=None):
+        """Write the pdf to target, or return its bytes when target is None."""
+        return self.html_class(string=html_content).write_pdf(
+            target, stylesheets=[self.stylesheet], font_config=self.font_config
+        )
+
+
+def get_renderer():
+    """Return the renderer of this process, creating it on first use."""
+    global _renderer
+    if _renderer is None:
+        with _lock:
+            if _renderer is None:
+                _renderer = PdfRenderer()
+    return _renderer
+
+
+def warm_up():
+    """Create the renderer and lay out a small page to load the fonts."""
+    try:
+        get_renderer().write_pdf('<table class="dataframe"><tr><td>-</td></tr></table>')
+    except Exception as ex:
+        logger.error(ex)
+
+
+def init_worker():
+    """Process pool initializer: set up django and warm the renderer."""
+    import django
+
+    django.setup()
+    warm_up()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+content addressed cache of rendered invoice reports
+"""
+import glob
+import hashlib
+import os
+import time
+from functools import partial
+
+from django.db.models import Count
+from django.db.models import Max
+from django.db.models import Sum
+
+from invoice_gen import settings
+from invoice_gen.settings import logger
+from users import currency
+from users.models import Invoice
+from users.renderer import get_renderer
+
+
+def fingerprint(user_id):
+    """
+    Hash of the row count, last update and ids of a user's lines and of the
+    version of the exchange rates this process totals them with.
+    """
+    state = Invoice.objects.filter(user_id=user_id).aggregate(
+        count=Count("id"), last_update=Max("updated_at"), ids=Sum("id")
+    )
+    return digest(
+        user_id,
+        state["count"],
+        state["last_update"],
+        state["ids"],
+        currency.version(),
+    )
+
+
+def digest(user_id, count, last_update, ids, rates_version):
+    raw = "%s|%s|%s|%s|%s" % (
+        user_id,
+        count,
+        last_update.isoformat() if last_update else "",
+        ids or 0,
+        rates_version,
+    )
+    return hashlib.sha256(raw.encode("utf8")).hexdigest()
+
+
+def cache_name(user_id, digest):
+    """Name of a cached report relative to MEDIA_ROOT."""
+    return "%s/report_%s_%s.pdf" % (settings.REPORT_CACHE_DIR, user_id, digest[:32])
+
+
+def cache_path(name):
+    return os.path.join(settings.MEDIA_ROOT, name)
+
+
+def get_or_render(user_id, render):
+    """
+    Return the cached report name for the user's current lines, calling
+    render(path) to write it on a miss.
+    """
+    name = cache_name(user_id, fingerprint(user_id))
+    if not os.path.exists(cache_path(name)):
+        _render(cache_path(name), render)
+        evict()
+    return name
+
+
+def cached_report(user_id):
+    """Return the cached report name of a user, or None on a miss."""
+    name = cache_name(user_id, fingerprint(user_id))
+    if os.path.exists(cache_path(name)):
+        return name
+    return None
+
+
+def _render(path, render):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # render next to the target and rename, so readers never see a partial file
+    tmp_path = "%s.%s.tmp" % (path, os.getpid())
+    try:
+        render(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_cached_pdf(html_content, path):
+    """Render html into the cache at path, used by batch pool workers."""
+    _render(path, partial(get_renderer().write_pdf, html_content))
+
+
+def invalidate(user_id):
+    """Remove every cached report of a user."""
+    pattern = cache_path(cache_name(user_id, "*"))
+    for path in glob.glob(pattern):
+        try:
+            os.remove(path)
+        except OSError as ex:
+            logger.error(ex)
+
+
+def evict(max_bytes=None, max_age=None):
+    """Drop reports older than max_age, then the oldest until under max_bytes."""
+    max_bytes = settings.REPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    max_age = settings.REPORT_CACHE_MAX_AGE if max_age is None else max_age
+    directory = cache_path(settings.REPORT_CACHE_DIR)
+    if not os.path.isdir(directory):
+        return 0
+
+    now = time.time()
+    entries = []
+    removed = 0
+    for entry in os.scandir(directory):
+        if not entry.is_file() or not entry.name.endswith(".pdf"):
+            continue
+        stat = entry.stat()
+        if now - stat.st_mtime > max_age:
+            removed += _remove(entry.path)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        removed += _remove(path)
+        total -= size
+    return removed
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return 1
+    except OSError as ex:
+        logger.error(ex)
+        return 0
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+helpers used to build the invoice report html
+"""
+import io
+from html import escape
+
+from invoice_gen import settings
+from users import currency
+from users.models import Invoice
+from users.pricing import from_fixed
+from users.pricing import from_minor
+from users.renderer import get_renderer
+from utils.number_utils import money
+
+REPORT_COLUMNS = ("Name", "Total Price")
+
+SUMMARY_TEMPLATE = """
+        <div>
+                        <div>Subtotal without tax: {tax}</div>
+                        <div>Subtotal with tax: {with_tax}</div>
+                        <div>Final amount with discount applied : {amount}</div>
+        </div>
+                    """
+
+
+def render_table(rows, columns=REPORT_COLUMNS):
+    """Yield the html of a table in the same layout as DataFrame.to_html()."""
+    yield '<table border="1" class="dataframe">\n'
+    yield "  <thead>\n"
+    yield '    <tr style="text-align: right;">\n'
+    yield "      <th></th>\n"
+    for column in columns:
+        yield "      <th>%s</th>\n" % escape(str(column), quote=False)
+    yield "    </tr>\n"
+    yield "  </thead>\n"
+    yield "  <tbody>\n"
+    for label, row in enumerate(rows, start=1):
+        yield "    <tr>\n"
+        yield "      <th>%s</th>\n" % label
+        for value in row:
+            yield "      <td>%s</td>\n" % escape(str(value), quote=False)
+        yield "    </tr>\n"
+    yield "  </tbody>\n"
+    yield "</table>"
+
+
+def line_amount(minor, code):
+    """Format a line total in minor units, naming any foreign currency."""
+    amount = money(from_minor(minor or 0))
+    if code != settings.BASE_CURRENCY:
+        amount = "%s %s" % (amount, code)
+    return amount
+
+
+def invoice_rows(invoices):
+    """Yield (name, total price) for every line, streamed from the database."""
+    lines = (
+        invoices.with_minor_totals()
+        .order_by("id")
+        .values_list("name", "line_minor", "currency")
+    )
+    for name, minor, code in lines.iterator():
+        yield name, line_amount(minor, code)
+
+
+def render_report_html(user_id):
+    """Build the report html of a user's invoice lines."""
+    invoices = Invoice.objects.filter(user_id=user_id)
+    return build_report_html(
+        invoice_rows(invoices), invoices.fixed_totals(currency.rates())
+    )
+
+
+def build_report_html(rows, totals):
+    """Build the report html from (name, total) rows and fixed unit totals."""
+    html_content = io.StringIO()
+    for chunk in render_table(rows):
+        html_content.write(chunk)
+    html_content.write(
+        SUMMARY_TEMPLATE.format(
+            tax=money(from_fixed(totals["sub_total"])),
+            with_tax=money(from_fixed(totals["sub_total_tax"])),
+            amount=money(from_fixed(totals["final_amount"])),
+        )
+    )
+    return html_content.getvalue()
+
+
+def write_report_pdf(user_id, path):
+    """Render a user's report and write the pdf to path."""
+    get_renderer().write_pdf(render_report_html(user_id), path)
+
+
+def render_report_pdf(user_id):
+    """Render a user's report and return the pdf bytes."""
+    return get_renderer().write_pdf(render_report_html(user_id))
@@ -2,7 +2,9 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
+from users import currency
 from users.models import Invoice
+from utils.message_utils import get_message
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -42,3 +44,36 @@ class InvoiceSerializer(serializers.ModelSerializer):
             "created_at",
             "updated_at",
         )
+
+
+class InvoiceLineSerializer(InvoiceSerializer):
+    """Validates one uploaded invoice line, the owner comes from the token."""
+
+    class Meta(InvoiceSerializer.Meta):
+        exclude = (
+            "user_id",
+            "created_at",
+            "updated_at",
+        )
+        # validate_quantity only runs for a present, non null quantity
+        extra_kwargs = {
+            "quantity": {
+                "required": True,
+                "allow_null": False,
+                "error_messages": {
+                    "required": get_message(326),
+                    "null": get_message(326),
+                },
+            }
+        }
+
+    def validate_quantity(self, value):
+        if not value or value <= 0:
+            raise serializers.ValidationError(get_message(326))
+        return value
+
+    def validate_currency(self, value):
+        value = value.upper()
+        if value not in currency.rates():
+            raise serializers.ValidationError(get_message(331))
+        return value
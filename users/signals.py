@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from authentication import token_cache
+from invoice_gen import settings
+from users import currency
+from users import report_cache
+from users import summaries
+from users.models import APIUser
+from users.models import CurrencyRate
+from users.models import Invoice
+from users.models import Token
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invalidate_report_cache(sender, instance, **kwargs):
+    if instance.user_id_id:
+        report_cache.invalidate(instance.user_id_id)
+
+
+@receiver(pre_save, sender=Invoice)
+def remember_previous_user(sender, instance, **kwargs):
+    # an edit may move the line to another user, whose summary changes too
+    instance._previous_user_id = None
+    if instance.pk is not None:
+        instance._previous_user_id = (
+            Invoice.objects.filter(pk=instance.pk)
+            .values_list("user_id", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Invoice)
+def update_summary_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_user_id", None)
+    if created and previous is None:
+        summaries.add_lines(instance.user_id_id, [instance])
+    else:
+        # the old amounts of an edited line are gone, recount its users
+        summaries.rebuild({previous, instance.user_id_id})
+
+
+@receiver(post_delete, sender=Invoice)
+def update_summary_on_delete(sender, instance, **kwargs):
+    summaries.remove_lines(instance.user_id_id, [instance])
+
+
+@receiver(post_save, sender=CurrencyRate)
+@receiver(post_delete, sender=CurrencyRate)
+def reprice_currency(sender, instance, **kwargs):
+    # cached reports hold amounts converted with the old rate, summaries are
+    # kept in the line currencies and converted when read
+    currency.invalidate()
+    if instance.currency == settings.BASE_CURRENCY:
+        return
+    user_ids = list(
+        Invoice.objects.filter(currency=instance.currency)
+        .order_by()
+        .values_list("user_id", flat=True)
+        .distinct()
+    )
+    for user_id in user_ids:
+        report_cache.invalidate(user_id)
+
+
+@receiver(post_save, sender=APIUser)
+def reload_revocations(sender, instance, created, **kwargs):
+    # an edit may (de)activate the user, whose signed jwts follow is_active
+    if not created:
+        token_cache.revocations_changed()
+
+
+@receiver(pre_delete, sender=APIUser)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    # the Token rows go with the user, revoke their signed jwts first
+    tokens = Token.objects.filter(user_id=instance, is_expired=False)
+    token_cache.expire_pairs(tokens.values_list("access_token", "refresh_token"))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+incremental maintenance of InvoiceSummary rows
+"""
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import Sum
+from django.utils import timezone
+
+from users import currency
+from users import pricing
+from users.models import Invoice
+from users.models import InvoiceSummary
+
+
+def line_amounts(lines, groups=None):
+    """
+    Return {currency: [count, minor total, fixed tax, fixed discount]} of
+    invoices, adding to groups when given.
+    """
+    return pricing.currency_groups((invoice.price_columns for invoice in lines), groups)
+
+
+def apply_delta(user_id, groups, sign=1):
+    """
+    Add (sign 1) or subtract (sign -1) the currency groups to the user's
+    summary rows. Only added lines create a missing row: removed ones may
+    belong to a user being deleted, whose summary must not be recreated.
+    """
+    if not user_id:
+        return
+    with transaction.atomic():
+        for code, (count, minor, tax, discount) in groups.items():
+            if not count:
+                continue
+            if sign > 0:
+                InvoiceSummary.objects.get_or_create(user_id_id=user_id, currency=code)
+            InvoiceSummary.objects.filter(user_id=user_id, currency=code).update(
+                line_count=F("line_count") + sign * count,
+                minor_total=F("minor_total") + sign * minor,
+                tax_fixed=F("tax_fixed") + sign * tax,
+                discount_fixed=F("discount_fixed") + sign * discount,
+                updated_at=timezone.now(),
+            )
+
+
+def add_lines(user_id, lines):
+    apply_delta(user_id, line_amounts(lines))
+
+
+def remove_lines(user_id, lines):
+    apply_delta(user_id, line_amounts(lines), sign=-1)
+
+
+def rebuild(user_ids=None):
+    """Recompute the summaries of user_ids, or of every user, from the lines."""
+    lines = Invoice.objects.filter(user_id__isnull=False)
+    summaries = InvoiceSummary.objects.all()
+    if user_ids is not None:
+        user_ids = [user_id for user_id in user_ids if user_id]
+        lines = lines.filter(user_id__in=user_ids)
+        summaries = summaries.filter(user_id__in=user_ids)
+    totals = (
+        lines.with_minor_totals()
+        .order_by("user_id")
+        .values_list("user_id", "currency")
+        .annotate(
+            Count("id"),
+            Sum("line_minor"),
+            Sum("line_tax_fixed"),
+            Sum("line_discount_fixed"),
+        )
+    )
+    rebuilt = [
+        InvoiceSummary(
+            user_id_id=user_id,
+            currency=code,
+            line_count=count,
+            minor_total=minor or 0,
+            tax_fixed=tax or 0,
+            discount_fixed=discount or 0,
+        )
+        for user_id, code, count, minor, tax, discount in totals
+    ]
+    with transaction.atomic():
+        summaries.delete()
+        InvoiceSummary.objects.bulk_create(rebuilt)
+    return len({summary.user_id_id for summary in rebuilt})
+
+
+def summary_totals(user_id):
+    """
+    Return the line count and report totals of a user without a scan, each
+    currency converted once, like the report does.
+    """
+    groups = InvoiceSummary.objects.filter(user_id=user_id).values_list(
+        "currency", "line_count", "minor_total", "tax_fixed", "discount_fixed"
+    )
+    count, *amounts = pricing.fixed_totals(groups, currency.rates())
+    totals = pricing.summarize(*amounts)
+    return count, {key: pricing.from_fixed(value) for key, value in totals.items()}
@@ -1,2 +1,447 @@
 # -*- coding: utf-8 -*-
-# Create your tests here.
+import datetime
+import io
+import os
+import re
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.admin import site
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import ProtectedError
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication import token_cache
+from invoice_gen import settings
+from jwt_utils.codec import default_codec
+from users import currency
+from users import report_cache
+from users import summaries
+from users.admin_jobs import run_job
+from users.bulk_actions import deactivate_users
+from users.fixture_io import dump_fixture
+from users.fixture_io import load_invoice_fixture
+from users.ingestion import ingest_invoice_lines
+from users.ingestion import iter_csv_rows
+from users.models import AdminJob, APIUser, CurrencyRate, Invoice, InvoiceSummary
+from users.models import ReportJob, RevokedToken, Token
+from users.pricing import from_fixed
+from users.reports import invoice_rows
+from users.summaries import summary_totals
+
+USERS = 1000
+LINES_PER_USER = 20
+TOKENS_PER_USER = 2
+
+# a full pass over one of our tables, as reported by EXPLAIN on each backend
+FULL_SCAN = {
+    "sqlite": re.compile(r"\bSCAN (?:TABLE )?(users_\w+)"),
+    "postgresql": re.compile(r"Seq Scan on (users_\w+)"),
+}
+
+
+def forget_rates(test):
+    """Drop the process copy of the rates before and after a test."""
+    currency.invalidate()
+    test.addCleanup(currency.invalidate)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Runs the requests served by users/views.py and
+    authentication/authentication.py against many users, lines and tokens and
+    checks that no query they issue reads a whole users_* table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        APIUser.objects.bulk_create(
+            APIUser(email="user%s@example.com" % i, password="!") for i in range(USERS)
+        )
+        users = list(APIUser.objects.all())
+        Invoice.objects.bulk_create(
+            Invoice(
+                user_id=user,
+                name="line %s" % line,
+                quantity=line + 1,
+                unit_price=Decimal("9.99"),
+                tax=Invoice.TAX[line % len(Invoice.TAX)][0],
+                discount=line % 10,
+            )
+            for user in users
+            for line in range(LINES_PER_USER)
+        )
+        Token.objects.bulk_create(
+            Token(
+                user_id=user,
+                access_token="%s-%s" % (user.pk, n),
+                access_token_digest="%064d" % (user.pk * TOKENS_PER_USER + n),
+                is_expired=True,
+            )
+            for user in users
+            for n in range(TOKENS_PER_USER)
+        )
+        cls.user = APIUser.objects.create_user(
+            {"email": "explain@example.com", "password": "secret1!x"}
+        )
+        Invoice.objects.bulk_create(
+            Invoice(user_id=cls.user, name="mine %s" % line, quantity=1, tax=5)
+            for line in range(LINES_PER_USER)
+        )
+        with connection.cursor() as cursor:
+            # let the planner see the table sizes
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        caches[settings.TOKEN_CACHE_ALIAS].clear()
+        forget_rates(self)
+        self.client = APIClient()
+
+    def assertNoFullScans(self, queries):
+        pattern = FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            self.skipTest("no plan check for %s" % connection.vendor)
+        statements = [
+            query["sql"]
+            for query in queries
+            if query["sql"].lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))
+        ]
+        self.assertTrue(statements)
+        prefix = connection.ops.explain_prefix
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute("%s %s" % (prefix, sql))
+                plan = "\n".join(" ".join(map(str, row)) for row in cursor.fetchall())
+                self.assertIsNone(pattern.search(plan), "%s\n%s" % (sql, plan))
+
+    def login(self):
+        response = self.client.post(
+            "/api/login",
+            {"email": "explain@example.com", "password": "secret1!x"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["access_token"]
+
+    def test_login_and_logout(self):
+        with CaptureQueriesContext(connection) as captured:
+            token = self.login()
+            self.client.credentials(HTTP_AUTHORIZATION=token)
+            response = self.client.post("/api/logout", format="json")
+        self.assertEqual(response.json()["code"], 200)
+        self.assertNoFullScans(captured.captured_queries)
+
+    def test_invoice_listing(self):
+        self.client.credentials(HTTP_AUTHORIZATION=self.login())
+        # the rate table is small and read whole, once per process
+        currency.rates()
+        with CaptureQueriesContext(connection) as captured:
+            page = self.client.get("/api/invoice?limit=5").json()
+            self.client.get("/api/invoice", {"limit": 5, "cursor": page["cursor"]})
+            self.client.get("/api/invoice", {"tax": 5, "created_from": "2000-01-01"})
+            self.client.get("/api/invoice", {"name": "mine 1"})
+            self.client.get("/api/invoice/summary")
+        self.assertEqual(len(page["results"]), 5)
+        self.assertNoFullScans(captured.captured_queries)
+
+    def test_report_queries(self):
+        invoices = Invoice.objects.filter(user_id=self.user)
+        rates = currency.rates()
+        with CaptureQueriesContext(connection) as captured:
+            report_cache.fingerprint(self.user.pk)
+            rows = list(invoice_rows(invoices))
+            invoices.fixed_totals(rates)
+        self.assertEqual(len(rows), LINES_PER_USER)
+        self.assertNoFullScans(captured.captured_queries)
+
+
+class JwtTokenTests(TestCase):
+    """Signed jwt tokens, verified without the Token table."""
+
+    def setUp(self):
+        caches[settings.TOKEN_CACHE_ALIAS].clear()
+        patcher = mock.patch.object(default_codec, "token_format", "jwt")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = APIUser.objects.create_user(
+            {"email": "jwt@example.com", "password": "secret1!x"}
+        )
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post(
+            "/api/login",
+            {"email": "jwt@example.com", "password": "secret1!x"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_invoices(self, token):
+        return self.client.get("/api/invoice", HTTP_AUTHORIZATION=token)
+
+    def test_refresh_token_does_not_authenticate(self):
+        tokens = self.login()
+        self.assertEqual(self.get_invoices(tokens["access_token"]).status_code, 200)
+        self.assertEqual(self.get_invoices(tokens["refresh_token"]).status_code, 403)
+
+    def test_logout_and_login_revoke_both_tokens(self):
+        first = self.login()
+        second = self.login()
+        response = self.client.post(
+            "/api/logout", HTTP_AUTHORIZATION=second["access_token"]
+        )
+        self.assertEqual(response.json()["code"], 200)
+        # revocations must not depend on what the cache still holds
+        caches[settings.TOKEN_CACHE_ALIAS].clear()
+        for token in first.values():
+            if isinstance(token, str) and token.count(".") == 2:
+                self.assertEqual(self.get_invoices(token).status_code, 403)
+        self.assertEqual(self.get_invoices(second["access_token"]).status_code, 403)
+        self.assertEqual(RevokedToken.objects.count(), 4)
+
+    def test_revocation_checks_skip_the_database(self):
+        payload = default_codec.decode(self.login()["access_token"])
+        token_cache.is_revoked(payload)
+        with self.assertNumQueries(0):
+            self.assertFalse(token_cache.is_revoked(payload))
+        token_cache.revoke(payload)
+        self.assertTrue(token_cache.is_revoked(payload))
+        # an evicted version reloads the list instead of forgetting it
+        caches[settings.TOKEN_CACHE_ALIAS].clear()
+        self.assertTrue(token_cache.is_revoked(payload))
+
+    def test_deactivated_user_is_refused(self):
+        tokens = self.login()
+        deactivate_users(APIUser.objects.filter(pk=self.user.pk))
+        self.assertEqual(self.get_invoices(tokens["access_token"]).status_code, 403)
+        response = self.client.post(
+            "/api/login",
+            {"email": "jwt@example.com", "password": "secret1!x"},
+            format="json",
+        )
+        self.assertNotEqual(response.status_code, 200)
+        self.assertEqual(RevokedToken.objects.count(), 2)
+
+    def test_inactive_user_is_refused_in_aes_format(self):
+        default_codec.token_format = "aes"
+        token = self.login()["access_token"]
+        APIUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        caches[settings.TOKEN_CACHE_ALIAS].clear()
+        self.assertEqual(self.get_invoices(token).status_code, 403)
+
+
+class IngestionTests(TestCase):
+    def setUp(self):
+        forget_rates(self)
+        self.user = APIUser.objects.create_user(
+            {"email": "ingest@example.com", "password": "secret1!x"}
+        )
+
+    def test_lines_without_quantity_are_rejected(self):
+        result = ingest_invoice_lines(
+            [
+                {"name": "noqty", "unit_price": "5"},
+                {"name": "nullqty", "unit_price": "5", "quantity": None},
+                {"name": "ok", "unit_price": "5", "quantity": 2},
+            ],
+            self.user.pk,
+        )
+        self.assertEqual((result["inserted"], result["rejected"]), (1, 2))
+        self.assertFalse(Invoice.objects.filter(quantity__isnull=True).exists())
+
+    def test_csv_empty_quantity_cell_is_rejected(self):
+        upload = io.BytesIO(b"name,quantity,unit_price\nfoo,,3\nbar,2,\n")
+        result = ingest_invoice_lines(iter_csv_rows(upload), self.user.pk)
+        self.assertEqual((result["inserted"], result["rejected"]), (1, 1))
+        self.assertEqual(result["errors"][0]["line"], 0)
+
+    def test_upsert_updates_the_currency(self):
+        CurrencyRate.objects.create(currency="EUR", rate=Decimal("1.1"))
+        line = {"name": "keyed", "quantity": 1, "unit_price": "5", "line_key": "k1"}
+        ingest_invoice_lines([line], self.user.pk)
+        result = ingest_invoice_lines([dict(line, currency="EUR")], self.user.pk)
+        self.assertEqual(result["updated"], 1)
+        self.assertEqual(Invoice.objects.get(line_key="k1").currency, "EUR")
+
+
+class SummaryTests(TestCase):
+    def setUp(self):
+        forget_rates(self)
+
+    def test_deleting_a_user_with_lines(self):
+        user = APIUser.objects.create_user(
+            {"email": "gone@example.com", "password": "secret1!x"}
+        )
+        Invoice.objects.create(
+            user_id=user, name="line", quantity=2, unit_price=Decimal("1.50")
+        )
+        self.assertEqual(InvoiceSummary.objects.get(user_id=user).line_count, 1)
+        user_id = user.pk
+        user.delete()
+        self.assertFalse(APIUser.objects.filter(pk=user_id).exists())
+        self.assertFalse(InvoiceSummary.objects.filter(user_id=user_id).exists())
+
+    def test_summary_converts_each_currency_once(self):
+        CurrencyRate.objects.create(currency="EUR", rate=Decimal("1.1"))
+        user = APIUser.objects.create_user(
+            {"email": "eur@example.com", "password": "secret1!x"}
+        )
+        for _ in range(2):
+            Invoice.objects.create(
+                user_id=user, name="cent", quantity=1, unit_price="0.05", currency="EUR"
+            )
+        incremental = summary_totals(user.pk)
+        summaries.rebuild([user.pk])
+        self.assertEqual(summary_totals(user.pk), incremental)
+        invoices = Invoice.objects.filter(user_id=user)
+        report = invoices.fixed_totals(currency.rates())
+        self.assertEqual(incremental[1]["sub_total"], Decimal("0.11"))
+        self.assertEqual(from_fixed(report["sub_total"]), Decimal("0.11"))
+
+
+class ReportCacheTests(TestCase):
+    def setUp(self):
+        forget_rates(self)
+
+    def test_fingerprint_follows_the_exchange_rates(self):
+        rate = CurrencyRate.objects.create(currency="EUR", rate=Decimal("1.1"))
+        user = APIUser.objects.create_user(
+            {"email": "rates@example.com", "password": "secret1!x"}
+        )
+        Invoice.objects.create(
+            user_id=user, name="line", quantity=1, unit_price=1, currency="EUR"
+        )
+        before = report_cache.fingerprint(user.pk)
+        rate.rate = Decimal("1.2")
+        rate.save()
+        self.assertNotEqual(report_cache.fingerprint(user.pk), before)
+
+
+class CurrencyTests(TestCase):
+    def setUp(self):
+        forget_rates(self)
+        self.user = APIUser.objects.create_user(
+            {"email": "fx@example.com", "password": "secret1!x"}
+        )
+
+    def test_line_in_an_unknown_currency(self):
+        line = Invoice.objects.create(
+            user_id=self.user, name="yen", quantity=1, unit_price=1, currency="JPY"
+        )
+        with self.assertRaises(ValidationError):
+            line.full_clean()
+
+    def test_rate_in_use_cannot_be_deleted(self):
+        rate = CurrencyRate.objects.create(currency="EUR", rate=Decimal("1.1"))
+        Invoice.objects.create(
+            user_id=self.user, name="eur", quantity=1, unit_price=1, currency="EUR"
+        )
+        with self.assertRaises(ProtectedError):
+            rate.delete()
+        Invoice.objects.filter(currency="EUR").delete()
+        rate.delete()
+
+    def test_admin_columns_use_the_report_amounts(self):
+        Invoice.objects.create(
+            user_id=self.user,
+            name="pen",
+            quantity=3,
+            unit_price=Decimal("0.335"),
+            tax=10,
+            discount=5,
+        )
+        admin = site._registry[Invoice]
+        line = admin.get_queryset(None).order_by("-line_minor").get()
+        self.assertEqual(admin.total_price(line), Decimal("1.02"))
+        self.assertEqual(admin.tax_amount(line), Decimal("0.102"))
+        self.assertEqual(admin.discount_amount(line), Decimal("0.051"))
+
+
+class AdminJobTests(TestCase):
+    def setUp(self):
+        self.user = APIUser.objects.create_user(
+            {"email": "staff@example.com", "password": "secret1!x"}
+        )
+        self.user.is_staff = True
+        self.user.save()
+
+    def test_expired_job_stays_failed(self):
+        job = AdminJob.objects.create(
+            kind=AdminJob.LOADDATA, application="users", model="CurrencyRate"
+        )
+
+        def expire(*args):
+            AdminJob.objects.filter(pk=job.pk).update(status=ReportJob.FAILED)
+            return "users/fixtures/currencyrate.json"
+
+        with mock.patch("users.admin_jobs.loaddata", expire), mock.patch(
+            "users.admin_jobs.close_old_connections"
+        ):
+            run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.FAILED)
+        self.assertIsNone(job.file_name)
+
+    def test_export_download_needs_the_view_permission(self):
+        file_name = "invoice_2020-01-01.json"
+        AdminJob.objects.create(
+            kind=AdminJob.DUMPDATA,
+            application="users",
+            model="Invoice",
+            status=ReportJob.DONE,
+            file_name=file_name,
+        )
+        with tempfile.TemporaryDirectory() as root, mock.patch.object(
+            settings, "ADMIN_EXPORT_ROOT", root
+        ):
+            with open(os.path.join(root, file_name), "w") as export:
+                export.write("[]")
+            url = reverse("download_export", args=[file_name])
+            self.client.force_login(self.user)
+            self.assertEqual(self.client.get(url).status_code, 403)
+            self.user.user_permissions.add(
+                Permission.objects.get(codename="view_invoice")
+            )
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+
+class FixtureTests(TestCase):
+    def setUp(self):
+        forget_rates(self)
+        self.user = APIUser.objects.create_user(
+            {"email": "fixture@example.com", "password": "secret1!x"}
+        )
+
+    def test_load_restores_dumped_lines(self):
+        for name in ("pen", "ink"):
+            Invoice.objects.create(
+                user_id=self.user, name=name, quantity=2, unit_price=Decimal("1.5")
+            )
+        # json fixtures keep milliseconds
+        dumped_at = timezone.now().replace(microsecond=0) - datetime.timedelta(days=30)
+        Invoice.objects.update(created_at=dumped_at, updated_at=dumped_at)
+        pen, ink = Invoice.objects.order_by("name").reverse()
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "invoice.json.gz")
+            dump_fixture(Invoice.objects.all(), path)
+            Invoice.objects.filter(pk=ink.pk).delete()
+            Invoice.objects.filter(pk=pen.pk).update(name="pencil")
+            stats = load_invoice_fixture(path, chunk_size=1)
+
+        self.assertEqual((stats["created"], stats["updated"]), (1, 1))
+        loaded = Invoice.objects.order_by("name")
+        self.assertEqual([line.name for line in loaded], ["ink", "pen"])
+        self.assertEqual({line.created_at for line in loaded}, {dumped_at})
+        self.assertEqual({line.updated_at for line in loaded}, {dumped_at})
+        self.assertEqual(summary_totals(self.user.pk)[0], 2)
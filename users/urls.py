@@ -18,6 +18,7 @@ from django.urls import include
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 from .views import LoginViewSet, loaddata_general, dumpdata_general
+from .views import download_export
 from .views import LogoutViewSet
 from .views import RegisterViewSet, InvoiceViewSet
 
@@ -33,4 +34,5 @@ urlpatterns = [
     path(r"", include(router.urls)),
     path("loaddata/<model>", loaddata_general, name="loaddata_general"),
     path("dumpdata/<model>", dumpdata_general, name="dumpdata_general"),
+    path("exports/<file_name>", download_export, name="download_export"),
 ]
@@ -1,35 +1,58 @@
 # -*- coding: utf-8 -*-
+import io
 import os
 import datetime
+from functools import partial
 
-import pandas as pd
-from django.apps import apps
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404, HttpResponseNotModified
 from django.shortcuts import redirect, render
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils.html import format_html
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.cache import cache_control
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import MultiPartParser
 
+from authentication import token_cache
 from authentication.authentication import JwtTokensAuthentication
 
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
-from django.core import management
+from django.core.exceptions import PermissionDenied
 from django.utils import timezone
+from jwt_utils.digest import token_digest
 from jwt_utils.jwt_generator import jwt_generator
+from rest_framework import mixins
 from rest_framework import status
 from rest_framework import viewsets
 from rest_framework.response import Response
 
-from users.models import Token, Invoice
+from users.models import AdminJob, Token, Invoice, ReportJob
 
 from utils.message_utils import get_message
+from utils.number_utils import money
 
 from utils.validation_utils import validate_email
 from utils.validation_utils import validate_null_or_empty
 from utils.validation_utils import validate_password
 from .forms import ConfirmationForm
+from . import report_cache
+from .admin_jobs import export_path
+from .admin_jobs import submit as submit_admin_job
+from .fixture_io import COMPRESSIONS
+from .ingestion import UPLOAD_FORMATS
+from .ingestion import ingest_invoice_lines
+from .ingestion import upload_format
+from .jobs import submit_report
+from .pagination import KeysetPagination
+from .reports import render_report_pdf
+from .reports import write_report_pdf
+
+from .summaries import summary_totals
 
 from .serializers import RegisterSerializer, LoginSerializer, InvoiceSerializer
 from invoice_gen import settings
@@ -107,7 +130,9 @@ class LoginViewSet(viewsets.ModelViewSet):
             resp["validations"] = validations
             return Response(resp, status=status.HTTP_412_PRECONDITION_FAILED)
         try:
-            user_obj = get_user_model().objects.get(email=email, is_verified=True)
+            user_obj = get_user_model().objects.get(
+                email=email, is_verified=True, is_active=True
+            )
             valid = user_obj.check_password(password)
 
             if not valid:
@@ -130,13 +155,21 @@ class LoginViewSet(viewsets.ModelViewSet):
                 "refresh",
                 user_obj.is_superuser,
             )
+            active_tokens = Token.objects.filter(
+                user_id=user_obj, is_expired=False
+            ).values_list("access_token", "refresh_token")
+            token_cache.expire_pairs(active_tokens)
             Token.objects.filter(user_id=user_obj).update(is_expired=1)
 
             Token.objects.update_or_create(
                 user_id=user_obj,
-                access_token=access_token,
-                refresh_token=refresh_token,
-                defaults={"updated_at": timezone.now()},
+                access_token_digest=token_digest(access_token),
+                defaults={
+                    "access_token": access_token,
+                    "refresh_token": refresh_token,
+                    "is_expired": False,
+                    "updated_at": timezone.now(),
+                },
             )
             return Response(
                 {
@@ -174,9 +207,12 @@ class LogoutViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
         try:
-            token_obj = Token.objects.get(access_token=token_id, user_id=user_id)
+            token_obj = Token.objects.get(
+                access_token_digest=token_digest(token_id), user_id=user_id
+            )
             token_obj.is_expired = 1
             token_obj.save()
+            token_cache.expire(token_id, token_obj.refresh_token)
             return Response({"code": 200, "message": get_message(200)})
         except Exception as ex:
             logger.error(ex)
@@ -186,11 +222,39 @@ class LogoutViewSet(viewsets.ModelViewSet):
             )
 
 
-class InvoiceViewSet(viewsets.ModelViewSet):
+class InvoiceViewSet(
+    mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+):
+    # lines are only written through create and upload, which validate them
+    # with InvoiceLineSerializer and take the owner from the token
     authentication_classes = (JwtTokensAuthentication,)
     permission_classes = ()
     serializer_class = InvoiceSerializer
-    queryset = get_user_model().objects.all()
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return Invoice.objects.filter(user_id=self.request.user.get("user_id"))
+
+    def filter_queryset(self, queryset):
+        """Apply the created_from, created_to, tax and name (prefix) filters."""
+        params = self.request.query_params
+        try:
+            for param, lookup in (
+                ("created_from", "created_at__gte"),
+                ("created_to", "created_at__lt"),
+            ):
+                if params.get(param):
+                    queryset = queryset.filter(**{lookup: parse_moment(params[param])})
+            if params.get("tax"):
+                tax = int(params["tax"])
+                if tax not in dict(Invoice.TAX):
+                    raise ValueError(tax)
+                queryset = queryset.filter(tax=tax)
+        except ValueError:
+            raise ParseError({"code": 330, "message": get_message(330)})
+        if params.get("name"):
+            queryset = queryset.filter(name__startswith=params["name"])
+        return queryset
 
     def create(self, request, *args, **kwargs):
         invoices = request.data.get("invoices", [])
@@ -202,26 +266,77 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             resp["code"] = 600
             resp["validations"] = validations
             return Response(resp, status=status.HTTP_412_PRECONDITION_FAILED)
-        lines = []
-        remaining_lines = []
-        for data in invoices:
-            if data.get("quantity") and data.get("quantity") > 0:
-                data["user_id_id"] = request.user.get("user_id")
-                lines.append(Invoice(**data))
-            else:
-                remaining_lines.append(data)
+        try:
+            result = ingest_invoice_lines(
+                invoices,
+                request.user.get("user_id"),
+                idempotency_key=request.headers.get("Idempotency-Key"),
+            )
+            return Response(
+                {
+                    "code": 200,
+                    "message": get_message(200),
+                    "inserted": result["inserted"],
+                    "updated": result["updated"],
+                    "rejected": result["rejected"],
+                    "error_lines": result["error_lines"],
+                    "errors": result["errors"],
+                }
+            )
 
+        except Exception as ex:
+            logger.error(ex)
+            return Response(
+                {
+                    "success": False,
+                    "message": get_message(114),
+                    "code": 114,
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+    @action(
+        detail=False,
+        url_path="upload",
+        methods=["POST"],
+        parser_classes=[MultiPartParser],
+    )
+    def upload(self, request, *args, **kwargs):
+        upload = request.FILES.get("file")
+        validations = []
+        validations = validate_null_or_empty(upload, 327, validations)
+        if len(validations) > 0:
+            resp = {}
+            resp["code"] = 600
+            resp["validations"] = validations
+            return Response(resp, status=status.HTTP_412_PRECONDITION_FAILED)
+        file_format = upload_format(upload.name, request.data.get("format"))
+        if file_format is None:
+            return Response(
+                {"code": 328, "message": get_message(328)},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
         try:
-            Invoice.objects.bulk_create(lines)
+            result = ingest_invoice_lines(
+                UPLOAD_FORMATS[file_format](upload.file),
+                request.user.get("user_id"),
+                max_errors=settings.INVOICE_UPLOAD_MAX_ERRORS,
+                idempotency_key=request.headers.get("Idempotency-Key"),
+            )
             return Response(
                 {
                     "code": 200,
                     "message": get_message(200),
-                    "error_lines": remaining_lines,
+                    "inserted": result["inserted"],
+                    "updated": result["updated"],
+                    "rejected": result["rejected"],
+                    "error_lines": result["error_lines"],
+                    "errors": result["errors"],
                 }
             )
 
-        except Exception:
+        except Exception as ex:
+            logger.error(ex)
             return Response(
                 {
                     "success": False,
@@ -234,42 +349,23 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     @cache_control(max_age=0)
     @action(detail=False, url_path="generate-invoice", methods=["POST"])
     def generate_invoice(self, request, *args, **kwargs):
-        sub_total = 0
-        sub_total_tax = 0
-        final_amount = 0
-        item = []
         user_id = request.user.get("user_id")
-        for invoice in Invoice.objects.filter(user_id=user_id):
-            item.append({"name": invoice.name, "total": invoice.total_price})
-            sub_total += invoice.total_price
-            sub_total_tax += invoice.total_price + invoice.tax_amount
-            final_amount += sub_total_tax - invoice.discount_amount
-
-        labels = [i for i in range(1, len(item) + 1)]
-        columns = ["Name", "Total Price"]
-        df = pd.DataFrame(0.00, index=labels, columns=columns)
-
-        for index, data in enumerate(item):
-            df.loc[index + 1] = list(data.values())
-
-        html_content = str(df.to_html())
-        html_content += """
-        <div>
-                        <div>Subtotal without tax: {{tax}}</div>
-                        <div>Subtotal with tax: {{with_tax}}</div>
-                        <div>Final amount with discount applied : {{amount}}</div>
-        </div>
-                    """
-
-        html_content = html_content.replace("{{tax}}", str(sub_total))
-        html_content = html_content.replace("{{with_tax}}", str(sub_total_tax))
-        html_content = html_content.replace("{{amount}}", str(final_amount))
-
-        from weasyprint import HTML
-
-        name = "report_" + str(user_id) + ".pdf"
-        path = os.path.join(settings.MEDIA_ROOT, name)
-        HTML(string=html_content).write_pdf(path, stylesheets=["users/style.css"])
+        mode = request.data.get("mode") or request.query_params.get("mode")
+        if mode == "stream":
+            return stream_report(request, user_id)
+        if mode == "job":
+            job = submit_report(user_id)
+            return Response(
+                {
+                    "code": 200,
+                    "message": get_message(200),
+                    "job_id": job.pk,
+                    "status": job.status,
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
+
+        name = report_cache.get_or_render(user_id, partial(write_report_pdf, user_id))
 
         return Response(
             {
@@ -279,20 +375,87 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             }
         )
 
+    @action(detail=False, url_path="summary", methods=["GET"])
+    def summary(self, request, *args, **kwargs):
+        line_count, totals = summary_totals(request.user.get("user_id"))
+        resp = {"code": 200, "message": get_message(200), "line_count": line_count}
+        resp.update((key, str(money(value))) for key, value in totals.items())
+        return Response(resp)
+
+    @action(
+        detail=False,
+        url_path=r"generate-invoice/(?P<job_id>[0-9]+)",
+        methods=["GET"],
+    )
+    def report_job(self, request, job_id=None, *args, **kwargs):
+        try:
+            job = ReportJob.objects.get(pk=job_id, user_id=request.user.get("user_id"))
+        except ObjectDoesNotExist as ex:
+            logger.error(ex)
+            return Response(
+                {"code": 204, "message": get_message(204)},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        resp = {
+            "code": 200,
+            "message": get_message(200),
+            "job_id": job.pk,
+            "status": job.status,
+        }
+        if job.status == ReportJob.DONE:
+            resp["path"] = settings.BASIC_PDF_URL + job.file_name
+        elif job.status == ReportJob.FAILED:
+            resp["code"] = 114
+            resp["message"] = get_message(114)
+        return Response(resp)
+
+
+def parse_moment(value):
+    """Parse a date or datetime query parameter into an aware datetime."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.datetime.combine(day, datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def stream_report(request, user_id):
+    """Return the report pdf in the response body, honouring If-None-Match."""
+    digest = report_cache.fingerprint(user_id)
+    etag = quote_etag(digest)
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        return response
+
+    path = report_cache.cache_path(report_cache.cache_name(user_id, digest))
+    if os.path.exists(path):
+        pdf = open(path, "rb")
+    else:
+        pdf = io.BytesIO(render_report_pdf(user_id))
+    response = FileResponse(
+        pdf, content_type="application/pdf", filename="report_%s.pdf" % user_id
+    )
+    response["ETag"] = etag
+    return response
+
 
 @login_required
 def loaddata_general(request, model):
     if request.method == "POST":
         application = request.POST.get("application")
         model = request.POST.get("model")
-        file = model.lower() + ".json"
-        management.call_command("loaddata", file)
+        job = submit_admin_job(AdminJob.LOADDATA, application, model, request.user)
         messages.add_message(
             request,
             messages.INFO,
             format_html(
-                "The <em>`%s`</em> fixture has been successfully loaded "
-                "with a <em>loaddata</em> operation." % file
+                "The <em>`%s`</em> fixture is being loaded by a <em>loaddata</em> "
+                "job (#%s), its progress is shown below." % (model.lower(), job.pk)
             ),
         )
         # Redirects to the admin page for the relevant model
@@ -314,46 +477,41 @@ def loaddata_general(request, model):
 @login_required
 def dumpdata_general(request, model):
     application = list(filter(None, request.META.get("HTTP_REFERER").split("/")))[-2]
-    # Dumps data from installed models to main fixtures folder
-
-    path = "%s/fixtures/%s.json" % (application, model.lower())
-    # A clean dumpdata
-    with open(path, "w") as f:
-        management.call_command(
-            "dumpdata", "%s.%s" % (application, model), stdout=f, indent=2
-        )
-    messages.add_message(
-        request,
-        messages.INFO,
-        format_html(
-            "A <em>dumpdata</em> command has been executed and the "
-            "data of the <em>`%s`</em> model of the <em>`%s`</em> application have successfully been saved in a "
-            "<em>fixture</em>." % (model, application)
-        ),
+    compression = request.GET.get("compression")
+    if compression not in COMPRESSIONS:
+        compression = None
+    job = submit_admin_job(
+        AdminJob.DUMPDATA, application, model, request.user, compression
     )
-    env_variables = dict(os.environ.items())
-    if "app" in env_variables and env_variables["app"] == "prod":
-        message = "fixtures from server " + str(datetime.datetime.now())
-        os.system("git add " + path)
-        os.system('git commit -m "' + message + '"')
-        os.system("git push ")
-    # A backup dumpdata (with date in file name)
-    path = "%s/fixtures/%s.json" % (
-        application,
-        str(model.lower()) + "_" + str(datetime.date.today()),
-    )
-    with open(path, "w") as f:
-        management.call_command(
-            "dumpdata", "%s.%s" % (application, model), stdout=f, indent=2
-        )
     messages.add_message(
         request,
         messages.INFO,
         format_html(
-            "The <em>`%s`</em> model of the <em>`%s`</em> application "
-            "has been successfully backed up with a <em>dumpdata</em> fixture with todays date."
-            % (model, application)
+            "A <em>dumpdata</em> job (#%s) has been started for the "
+            "<em>`%s`</em> model of the <em>`%s`</em> application, its progress "
+            "is shown below." % (job.pk, model, application)
         ),
     )
     # Redirects to the admin page for the relevant model
     return redirect("/admin/%s/%s/" % (application, model.lower()))
+
+
+@staff_member_required
+def download_export(request, file_name):
+    """
+    Send a finished admin dumpdata export, which is never public media, to
+    staff allowed to view the exported model.
+    """
+    path = export_path(file_name)
+    job = (
+        AdminJob.objects.filter(
+            kind=AdminJob.DUMPDATA, status=ReportJob.DONE, file_name=file_name
+        )
+        .order_by("-pk")
+        .first()
+    )
+    if path is None or job is None or not os.path.isfile(path):
+        raise Http404(file_name)
+    if not request.user.has_perm("%s.view_%s" % (job.application, job.model.lower())):
+        raise PermissionDenied
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=file_name)
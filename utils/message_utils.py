@@ -15,6 +15,12 @@ messages = {
     307: "Email cannot be null or empty.",
     308: "User id cannot be null or empty.",
     325: "Invoices cannot be null or empty.",
+    326: "Quantity must be greater than zero.",
+    327: "File cannot be null or empty.",
+    328: "File format must be csv or ndjson.",
+    329: "Invalid cursor.",
+    330: "Invalid filter value.",
+    331: "Unknown currency.",
     311: "Cannot use previous password.Please try with new password.",
     400: "Bad request",
     401: "Unauthorized token",
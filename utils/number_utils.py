@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+from decimal import ROUND_HALF_UP
+
+CENT = Decimal("0.01")
+
+
+# method to format an amount with two decimal places
+def money(amount):
+    return str(Decimal(amount).quantize(CENT, rounding=ROUND_HALF_UP))